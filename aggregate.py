@@ -1,14 +1,41 @@
 #!/usr/bin/env python3
 
 import argparse
+import array
+import collections
+import concurrent.futures
+import contextlib
+import difflib
+import functools
+import hashlib
+import heapq
+import io
+import itertools
 import json
+import multiprocessing
+import pickle
+import sqlite3
 
 import os
 import sys
 import re
+import tempfile
+import time
 from enum import Enum, unique
 
-import pandas as pd
+#numpy and pandas are slow to import, and are needed only to read an export file and to build the output
+#tables, so they are imported where they are used: a library caller feeding rows in does not pay for them
+#until it asks for the tables
+
+#Decoder for the JSON columns of the export: orjson or msgspec where installed, as they are several times
+#faster than json, which is the fallback
+try:
+  from orjson import loads as json_loads
+except ImportError:
+  try:
+    from msgspec.json import decode as json_loads
+  except ImportError:
+    json_loads = json.loads
 
 @unique
 class UnderlineType(Enum):
@@ -22,6 +49,8 @@ class WorkflowType(Enum):
   MINUTES = 2
   UNDERLINING = 3
 
+#'alpha' marks the alpha versions of the workflows: their minutes tables are transcribed column by column,
+#and their first (control flow) question was not required
 WORKFLOWS = {
  'Alpha-Index': {
     'type': WorkflowType.INDEX,
@@ -37,26 +66,37 @@ WORKFLOWS = {
     'type': WorkflowType.MINUTES,
     'id': 16890,
     'version': 4.9,
+    'alpha': True,
   },
   'Alpha-Tables': {
     'type': WorkflowType.MINUTES,
     'id': 16863,
     'version': 19.48,
+    'alpha': True,
   },
   'Alpha-Underlining': {
     'type': WorkflowType.UNDERLINING,
     'id': 16848,
     'version': 18.65,
+    'alpha': True,
   }
 }
 
+#Workflows, by id, whose first (control flow) question was not flagged required before the given version,
+#so that it may have no answer. This holds however the workflow is named, including with -w.
+OPTIONAL_CONTROL = {
+  16848: 19.81, #Underlining
+}
+
+def optional_control(workflow_data):
+  return workflow_data.get('alpha') or workflow_data['version'] < OPTIONAL_CONTROL.get(workflow_data['id'], 0)
+
 #expected_tasks can be scalar or sequence
 #if a scalar, there is only one legal task for the annotation
 #if a sequence, any of the given tasks is legal for the annotation
 def validate(expected_tasks, annotation):
-  if isinstance(expected_tasks, str): expected_tasks = [expected_tasks]
   task = annotation['task']
-  if not task in expected_tasks:
+  if (task != expected_tasks) if isinstance(expected_tasks, str) else (not task in expected_tasks):
     raise Exception(f'Invalid task type {task}: expected {expected_tasks}')
 
 #There has never yet been a case where I need multiple expected tasks for dropdowns
@@ -69,8 +109,9 @@ def get_dropdown_textbox_value(expected_dropdown_task, dropdown_annotation, expe
   if (not 'option' in value) or (value['option'] == False): return textbox_annotation['value'].strip()
   else: return value['label']
 
+#These are titles and positions, which repeat throughout a names index, so they are interned
 def get_dropdown_textbox_values(expected_dropdown_task, dropdown_annotations, expected_textbox_task, textbox_annotations):
-  return [get_dropdown_textbox_value(expected_dropdown_task, dd, expected_textbox_task, tb) for dd, tb in \
+  return [sys.intern(get_dropdown_textbox_value(expected_dropdown_task, dd, expected_textbox_task, tb)) for dd, tb in \
     zip(dropdown_annotations, textbox_annotations)]
 
 def get_value(expected_tasks, annotation):
@@ -84,88 +125,218 @@ def get_value(expected_tasks, annotation):
 def get_values(expected_tasks, annotations):
   return [get_value(expected_tasks, x) for x in annotations]
 
-#Return page number and any associated annoatation as a list for each page number
+COMMA_IN_BRACKETS = re.compile(r'\([^\),]*,[^\)]*\)')
+PAGEREF = re.compile(r'(\d+)\s*(?:\(\s*(.+?)\s*\))?')        #This regexp defines what volunteers are asked to do
+PAGEREF_ANNOTATION_FIRST = re.compile(r'(.+?)\s+(\d+)') #This regexp handles the case where volunteer instead puts the annotation at the beginning
+LINE_START = re.compile(r'^', re.MULTILINE)
+
+#Return page number and any associated annoatation as a tuple for each page number
 #Unfortunate naming, given that an 'annotation' is something returned from a Zooniverse volunteer,
 #but here refers to an annotation written in the minute book by a person
-def pageref_annotations(pagerefs):
-  match = re.search(r'\([^\),]*,[^\)]*\)', pagerefs)
+#Use pageref_annotations, which caches this
+def parse_pagerefs(pagerefs):
+  match = COMMA_IN_BRACKETS.search(pagerefs)
   if match: exit(f'Comma within brackets: assumption that we can split on comma is broken.\nMatch is "{match.group(0)}" in "{pagerefs}".')
   pagerefs = pagerefs.split(',')
   output = []
   for pageref in [x.strip() for x in pagerefs]:
-    #This regexp defines what volunteers are asked to do
-    match = re.fullmatch(r'(\d+)\s*(?:\(\s*(.+?)\s*\))?', pageref)
+    match = PAGEREF.fullmatch(pageref)
     if match:
-      output.append([match.group(1), match.group(2)])
+      output.append((match.group(1), match.group(2)))
       continue
 
-    #This regexp handles the case where volunteer instead puts the annotation at the beginning
-    match = re.fullmatch(r'(.+?)\s+(\d+)', pageref)
+    match = PAGEREF_ANNOTATION_FIRST.fullmatch(pageref)
     if match:
-      output.append([match.group(2), match.group(1)])
+      output.append((match.group(2), match.group(1)))
       continue
 
     #Exit if string is not of any form where we can work out what the volunteer meant
     exit(f'Bad pagerefs string: "{pageref}"')
-  return output
+  return tuple(output) #Immutable, as the cache hands the same parse to every caller
+
+#The same pagerefs strings recur throughout an index, so their parses are kept in a bounded LRU cache
+#pageref_annotations.cache_info() has the hit and miss counts
+PAGEREF_CACHE_SIZE = 4096
+pageref_annotations = functools.lru_cache(maxsize = PAGEREF_CACHE_SIZE)(parse_pagerefs)
+
+def set_pageref_cache_size(size):
+  global pageref_annotations
+  pageref_annotations = functools.lru_cache(maxsize = size)(parse_pagerefs)
+
+#Output rows: one record class per output table (Lines has its own columnar buffer)
+#Each normalises the types of its fields once, as the row is created. Pages arrive as str in the index
+#and table workflows' subject data, and as int from the minutes parser: they are always stored as int.
+class IndexRecord(collections.namedtuple('IndexRecord', ['page', 'entry', 'heading', 'subject', 'pageref', 'annotation'])):
+  __slots__ = ()
+  def __new__(cls, page, entry, heading, subject, pageref, annotation):
+    return super().__new__(cls, int(page), entry, heading, subject, pageref, annotation)
+
+class NamesRecord(collections.namedtuple('NamesRecord', ['page', 'entry', 'title', 'forename', 'surname', 'position', 'subject', 'pageref', 'annotation'])):
+  __slots__ = ()
+  def __new__(cls, page, entry, title, forename, surname, position, subject, pageref, annotation):
+    return super().__new__(cls, int(page), entry, title, forename, surname, position, subject, pageref, annotation)
+
+class AttendeesRecord(collections.namedtuple('AttendeesRecord', ['page', 'name'])):
+  __slots__ = ()
+  def __new__(cls, page, name):
+    return super().__new__(cls, int(page), name)
+
+#Tables have up to 6 columns: missing cells are None
+class TablesRecord(collections.namedtuple('TablesRecord', ['page', 'item', 'table', 'title', 'row', 'col1', 'col2', 'col3', 'col4', 'col5', 'col6'])):
+  __slots__ = ()
+  def __new__(cls, page, item, table, title, row, *cells):
+    return super().__new__(cls, int(page), item, table, title, row, *cells, *[None] * (6 - len(cells)))
+
+#Item is an int where it can be, otherwise the str that was transcribed
+class ItemsRecord(collections.namedtuple('ItemsRecord', ['page', 'item', 'title', 'text', 'resolution', 'classification'])):
+  __slots__ = ()
+  def __new__(cls, page, item, title, text, resolution, classification):
+    return super().__new__(cls, int(page), item, title, text, resolution, classification)
+
+class CommentsRecord(collections.namedtuple('CommentsRecord', ['page', 'comments'])):
+  __slots__ = ()
+  def __new__(cls, page, comments):
+    return super().__new__(cls, int(page), comments)
+
+#Wall time and counts for --profile: of each named stage, and of the annotations for each task ID
+#A disabled Profile (the default) records nothing and adds no timing to the stages
+#Profiles of worker processes are returned with their results and merged in with extend()
+class Profile:
+  __slots__ = ('enabled', 'stages', 'tasks')
+  DISABLED_STAGE = contextlib.nullcontext()
+
+  def __init__(self, enabled = False):
+    self.enabled = enabled
+    self.stages = {}
+    self.tasks = collections.Counter()
+
+  def add(self, name, seconds, count = 1):
+    stage = self.stages.setdefault(name, {'seconds': 0.0, 'count': 0})
+    stage['seconds'] += seconds
+    stage['count'] += count
+
+  def stage(self, name, count = 1):
+    if not self.enabled: return self.DISABLED_STAGE
+    return self.timed_stage(name, count)
+
+  @contextlib.contextmanager
+  def timed_stage(self, name, count):
+    start = time.perf_counter()
+    try: yield
+    finally: self.add(name, time.perf_counter() - start, count)
+
+  #Time the production of each item of iterable (such as a lazy reader or decoder), counting count(item)
+  def iterate(self, name, iterable, count = lambda x: 1):
+    if not self.enabled: return iterable
+    return self.timed_iterate(name, iter(iterable), count)
+
+  def timed_iterate(self, name, iterator, count):
+    while True:
+      start = time.perf_counter()
+      try: item = next(iterator)
+      except StopIteration:
+        self.add(name, time.perf_counter() - start, 0)
+        return
+      self.add(name, time.perf_counter() - start, count(item))
+      yield item
+
+  def count_tasks(self, annotations):
+    if self.enabled: self.tasks.update(x['task'] for x in annotations)
+
+  def extend(self, other):
+    for name, stage in other.stages.items(): self.add(name, stage['seconds'], stage['count'])
+    self.tasks.update(other.tasks)
+
+  def report(self):
+    return {'stages': self.stages, 'tasks': dict(sorted(self.tasks.items(), key = lambda x: (len(x[0]), x[0])))} #T2 before T10
+
+#Each parser below handles one kind of page (or, for the table parsers, the tables within a minutes page)
+#Its TASKS table maps each top-level task ID to the method that handles it, and is built once, when the
+#class is defined. The IDs of the tasks nested within each top-level task are class attributes.
+
+#TODO: Probably makes more sense to have a single index parser
+#Parses an 'Other page' of an index workflow
+class IndexParser:
+  __slots__ = ('page_number', 'results', 'out', 'heading', 'heading_stored', 'entry')
 
-#TODO: Probably makes more sense to have a single index-processing function
-def proc_index_other(page_data, annotations, index_other, comments):
   HEADING = 'T12'
   SUBJECT_PAGES = 'T11'
-  SUBJECT = ['T13', 'T16', 'T18']
-  PAGES   = ['T14', 'T17', 'T19']
+  SUBJECT = ('T13', 'T16', 'T18')
+  PAGES   = ('T14', 'T17', 'T19')
   SKIP    = 'T15'
   COMMENTS = 'T27'
 
-  page_number = page_data['page']
-  heading = None
-  heading_stored = True #TODO: This is getting messy -- would it help to have an inner function to update the array?
-  entry = 0
-  for annotation in annotations:
-    task = annotation['task']
-    value = annotation['value']
-    if task == HEADING:
-      print(value)
-      if not heading_stored:
-        index_other.append([page_number, entry, heading, None, None, None])
-        entry += 1
-      heading = value
-      heading_stored = False
-    elif task == SUBJECT_PAGES:
-      #Subject and Pages group pairwise
-      #TODO: Do I need to make sure that subject task matches page task, or is that already covered somehow?
-      #      If I do need to make sure, then I likely don't need validate() to be able to cope with multiple
-      #      valid task types any more.
-      for subject, pagerefs in \
-        zip(get_values(SUBJECT, value[0::2]),
-            get_values(PAGES,   value[1::2])):
-        if subject != '' or pagerefs != '':
-          subject = re.sub(r'^', '  ', subject, flags = re.MULTILINE)
-          print(subject, end=' >>> ')
-          print(pagerefs)
-          print()
-          if pagerefs == '':
-            index_other.append([page_number, entry, heading, subject, '', ''])
-            entry += 1
-          else:
-            for pageref, annotation in pageref_annotations(pagerefs):
-              index_other.append([page_number, entry, heading, subject, pageref, annotation])
-              entry += 1
-          heading_stored = True
-    elif task == COMMENTS:
-      if not heading_stored:
-        index_other.append([page_number, entry, heading, None, None, None])
-        entry += 1
-        heading_stored = True
-      print(f'Comments: {value}')
-      comments.append([page_number, value])
-      entry += 1
-    elif task == SKIP: continue
-    else: exit(f'Unknown task: {task}\n{value}')
+  def __init__(self, page_data, results, out = print):
+    self.page_number = page_data['page']
+    self.results = results
+    self.out = out
+    self.heading = None
+    self.heading_stored = True #TODO: This is getting messy -- would it help to have an inner function to update the array?
+    self.entry = 0
+
+  def parse(self, annotations):
+    for annotation in annotations:
+      task = annotation['task']
+      handler = self.TASKS.get(task)
+      if handler is None: exit(f'Unknown task: {task}\n{annotation["value"]}')
+      handler(self, annotation['value'])
+
+  def store_heading(self):
+    self.results.index_other.append(IndexRecord(self.page_number, self.entry, self.heading, None, None, None))
+    self.entry += 1
+    self.heading_stored = True
+
+  def proc_heading(self, value):
+    self.out(value)
+    if not self.heading_stored: self.store_heading()
+    self.heading = sys.intern(value) #Stored in every row until the next heading
+    self.heading_stored = False
+
+  def proc_subject_pages(self, value):
+    #Subject and Pages group pairwise
+    #TODO: Do I need to make sure that subject task matches page task, or is that already covered somehow?
+    #      If I do need to make sure, then I likely don't need validate() to be able to cope with multiple
+    #      valid task types any more.
+    index_other = self.results.index_other
+    for subject, pagerefs in \
+      zip(get_values(self.SUBJECT, value[0::2]),
+          get_values(self.PAGES,   value[1::2])):
+      if subject != '' or pagerefs != '':
+        subject = LINE_START.sub('  ', subject)
+        if self.out:
+          self.out(subject, end=' >>> ')
+          self.out(pagerefs)
+          self.out()
+        if pagerefs == '':
+          index_other.append(IndexRecord(self.page_number, self.entry, self.heading, subject, '', ''))
+          self.entry += 1
+        else:
+          for pageref, annotation in pageref_annotations(pagerefs):
+            index_other.append(IndexRecord(self.page_number, self.entry, self.heading, subject, pageref, annotation))
+            self.entry += 1
+        self.heading_stored = True
+
+  def proc_comments(self, value):
+    if not self.heading_stored: self.store_heading()
+    self.out(f'Comments: {value}')
+    self.results.comments.append(CommentsRecord(self.page_number, value))
+    self.entry += 1
+
+  def proc_skip(self, value): pass
+
+  TASKS = {
+    HEADING: proc_heading,
+    SUBJECT_PAGES: proc_subject_pages,
+    COMMENTS: proc_comments,
+    SKIP: proc_skip,
+  }
+
+#TODO: Probably makes more sense to have a single index parser
+#Parses a 'Name list' page of an index workflow
+#A heading ends the name list: the rest of the page is parsed as an 'Other page'
+class NamesParser:
+  __slots__ = ('page_data', 'results', 'out', 'entry')
 
-#TODO: Probably makes more sense to have a single index-processing function
-def proc_index_names(page_data, annotations, index_name, index_other, comments):
   NAME_COMBO = 'T0'
   SURNAME = 'T1'
   TITLE_STANDARD = 'T8'
@@ -179,145 +350,212 @@ def proc_index_names(page_data, annotations, index_name, index_other, comments):
   HEADING = 'T12'
   COMMENTS = 'T27'
 
-  page_number = page_data['page']
-  entry = 0
-  while(len(annotations)):
-    annotation = annotations.pop(0)
-    task = annotation['task']
-    value = annotation['value']
-    if task == NAME_COMBO:
-      for surname, forename, title, position, subject, pagerefs in \
-        zip(get_values(SURNAME,           value[0::8]),
-            get_values(FORENAME,          value[1::8]),
-            get_dropdown_textbox_values(TITLE_STANDARD, value[2::8], TITLE_OTHER, value[3::8]),
-            get_dropdown_textbox_values(POSITION_STANDARD, value[4::8], POSITION_OTHER, value[5::8]),
-            get_values(SUBJECT,           value[6::8]),
-            get_values(PAGES,             value[7::8])):
-        print(f'{title} {forename} {surname}, {position}    {subject} >>> {pagerefs}')
-        if pagerefs == '':
-          index_name.append([page_number, entry, title, forename, surname, position, subject, None, None])
-          entry += 1
-        else:
-          for pageref, annotation in pageref_annotations(pagerefs):
-            index_name.append([page_number, entry, title, forename, surname, position, subject, pageref, annotation])
-            entry += 1
-    elif task == COMMENTS:
-      print(f'Comments: {value}')
-      entry += 1
-    elif task == HEADING:
-      print()
-      annotations.insert(0, annotation)
-      proc_index_other(page_data, annotations, index_other, comments)
-      break
-    elif task == SKIP: continue
-    else: exit(f'Unknown task: {task}\n{value}')
+  def __init__(self, page_data, results, out = print):
+    self.page_data = page_data
+    self.results = results
+    self.out = out
+    self.entry = 0
+
+  def parse(self, annotations):
+    for i, annotation in enumerate(annotations):
+      task = annotation['task']
+      if task == self.HEADING:
+        self.out()
+        IndexParser(self.page_data, self.results, self.out).parse(annotations[i:])
+        break
+      handler = self.TASKS.get(task)
+      if handler is None: exit(f'Unknown task: {task}\n{annotation["value"]}')
+      handler(self, annotation['value'])
+
+  def proc_names(self, value):
+    page_number = self.page_data['page']
+    index_name = self.results.index_name
+    for surname, forename, title, position, subject, pagerefs in \
+      zip(get_values(self.SURNAME,           value[0::8]),
+          get_values(self.FORENAME,          value[1::8]),
+          get_dropdown_textbox_values(self.TITLE_STANDARD, value[2::8], self.TITLE_OTHER, value[3::8]),
+          get_dropdown_textbox_values(self.POSITION_STANDARD, value[4::8], self.POSITION_OTHER, value[5::8]),
+          get_values(self.SUBJECT,           value[6::8]),
+          get_values(self.PAGES,             value[7::8])):
+      if self.out: self.out(f'{title} {forename} {surname}, {position}    {subject} >>> {pagerefs}')
+      if pagerefs == '':
+        index_name.append(NamesRecord(page_number, self.entry, title, forename, surname, position, subject, None, None))
+        self.entry += 1
+      else:
+        for pageref, annotation in pageref_annotations(pagerefs):
+          index_name.append(NamesRecord(page_number, self.entry, title, forename, surname, position, subject, pageref, annotation))
+          self.entry += 1
+
+  def proc_comments(self, value):
+    self.out(f'Comments: {value}')
+    self.entry += 1
+
+  def proc_skip(self, value): pass
+
+  TASKS = {
+    NAME_COMBO: proc_names,
+    COMMENTS: proc_comments,
+    SKIP: proc_skip,
+  }
+
+#Parses the tables on one page of the alpha minutes workflows, which are transcribed column by column
+class AlphaTableParser:
+  __slots__ = ('page_number', 'results', 'out', 'counter', 'item_number', 'title', 'table')
 
-def proc_tables_alpha(page_data, task, value, tables):
   TABLE_FIRST_COMBO = 'T25'
   TABLE_STANDARD_NUMBER = 'T23'
   TABLE_TITLE = 'T24'
   TABLE_FIRST_HEADING = 'T47'
-  TABLE_FIRST_ROWS = ['T48', 'T49', 'T50', 'T51', 'T52', 'T53']
+  TABLE_FIRST_ROWS = ('T48', 'T49', 'T50', 'T51', 'T52', 'T53')
   TABLE_ROWS_COMBO = 'T36'
   TABLE_ROWS_HEADING = 'T26'
-  TABLE_ROWS = ['T30', 'T31', 'T32', 'T33', 'T34', 'T35']
+  TABLE_ROWS = ('T30', 'T31', 'T32', 'T33', 'T34', 'T35')
   TABLE_MORE_ROWS_COMBO = 'T46'
-  TABLE_MORE_ROWS = ['T39', 'T40', 'T41', 'T42', 'T43', 'T44', 'T45']
+  TABLE_MORE_ROWS = ('T39', 'T40', 'T41', 'T42', 'T43', 'T44', 'T45')
   TABLE_NEXT = 'T37'
 
-  page_number = page_data['page']
-
-  if task == TABLE_FIRST_COMBO:
-    proc_tables_alpha.counter += 1
-    proc_tables_alpha.item_number = get_value(TABLE_STANDARD_NUMBER, value[0])
-
-    proc_tables_alpha.title = get_value(TABLE_TITLE, value[1])
-    print(f"Table {proc_tables_alpha.counter} in item {proc_tables_alpha.item_number}")
-    print(f'\033[4m{proc_tables_alpha.title}\033[0m')
-    heading = get_value(TABLE_FIRST_HEADING, value[2])
-    column = [get_value(x, y) for x, y in zip(TABLE_FIRST_ROWS, value[3:])] #This will match each task to the particular value
-    proc_tables_alpha.table = [[heading]]
-    proc_tables_alpha.table[-1].extend(column)
-  elif task == TABLE_ROWS_COMBO:
-    heading = get_value(TABLE_ROWS_HEADING, value[0])
-    column = [get_value(x, y) for x, y in zip(TABLE_ROWS, value[1:])]
-    proc_tables_alpha.table.append([heading])
-    proc_tables_alpha.table[-1].extend(column)
-  elif task == TABLE_MORE_ROWS_COMBO:
-    column = [get_value(x, y) for x, y in zip(TABLE_MORE_ROWS, value)]
-    proc_tables_alpha.table[-1].extend(column)
-  elif task == TABLE_NEXT:
+  def __init__(self, page_number, results, out = print):
+    self.page_number = page_number
+    self.results = results
+    self.out = out
+    self.counter = 0
+    self.item_number = None
+    self.title = None
+    self.table = None
+
+  def parse(self, task, value):
+    handler = self.TASKS.get(task)
+    if handler is None: exit(f'Unknown task: {task}\n{value}')
+    handler(self, value)
+
+  def proc_first_column(self, value):
+    self.counter += 1
+    self.item_number = get_value(self.TABLE_STANDARD_NUMBER, value[0])
+
+    self.title = get_value(self.TABLE_TITLE, value[1])
+    self.out(f"Table {self.counter} in item {self.item_number}")
+    self.out(f'\033[4m{self.title}\033[0m')
+    heading = get_value(self.TABLE_FIRST_HEADING, value[2])
+    column = [get_value(x, y) for x, y in zip(self.TABLE_FIRST_ROWS, value[3:])] #This will match each task to the particular value
+    self.table = [[heading]]
+    self.table[-1].extend(column)
+
+  def proc_column(self, value):
+    heading = get_value(self.TABLE_ROWS_HEADING, value[0])
+    column = [get_value(x, y) for x, y in zip(self.TABLE_ROWS, value[1:])]
+    self.table.append([heading])
+    self.table[-1].extend(column)
+
+  def proc_more_rows(self, value):
+    column = [get_value(x, y) for x, y in zip(self.TABLE_MORE_ROWS, value)]
+    self.table[-1].extend(column)
+
+  def proc_next(self, value):
     if value == 'More rows in this column': None
     elif value == 'Another column': None
     elif value == 'Another table' or value[0:8] == 'Nothing ':
-      if value[0:8] == 'Nothing ': proc_tables_alpha.counter = 0
+      if value[0:8] == 'Nothing ': self.counter = 0
 
       #Normalise all columns to same length
-      max_length = len(proc_tables_alpha.table[0])
-      for x in proc_tables_alpha.table[1:]:
+      max_length = len(self.table[0])
+      for x in self.table[1:]:
         if len(x) > max_length: max_length = len(x)
-      for x in proc_tables_alpha.table:
+      for x in self.table:
         if len(x) < max_length: x.extend([None] * (max_length - len(x)))
 
       #Transpose, print and store
-      for i, row in enumerate(zip(*proc_tables_alpha.table)):
-        if i == 0: print(' '.join([f'*{x}*' for x in row]))
-        else: print(*row)
-
-        expanded_row = [*row]
-        expanded_row.extend([None] * (6 - len(row)))
-        tables.append([page_number, proc_tables_alpha.item_number, proc_tables_alpha.counter, proc_tables_alpha.title, i, *expanded_row]) #row 0 is the headings
-      print()
+      for i, row in enumerate(zip(*self.table)):
+        if not self.out: pass
+        elif i == 0: self.out(' '.join([f'*{x}*' for x in row]))
+        else: self.out(*row)
+
+        self.results.minutes_tables.append(TablesRecord(self.page_number, self.item_number, self.counter, self.title, i, *row)) #row 0 is the headings
+      self.out()
     else: raise Exception(f'Bad value: {value}')
-  else: exit(f'Unknown task: {task}\n{value}')
 
-def proc_tables(page_data, task, value, tables):
+  TASKS = {
+    TABLE_FIRST_COMBO: proc_first_column,
+    TABLE_ROWS_COMBO: proc_column,
+    TABLE_MORE_ROWS_COMBO: proc_more_rows,
+    TABLE_NEXT: proc_next,
+  }
+
+#Parses the tables on one page of the later minutes workflows, which are transcribed row by row
+class TableParser:
+  __slots__ = ('page_number', 'results', 'out', 'counter', 'row_number', 'item_number', 'title')
+
   TABLE_HEADERS_COMBO = 'T25'
   TABLE_STANDARD_NUMBER = 'T23'
   TABLE_TITLE = 'T24'
-  TABLE_COL_HEAD = ['T47', 'T48', 'T49', 'T50', 'T51', 'T52']
+  TABLE_COL_HEAD = ('T47', 'T48', 'T49', 'T50', 'T51', 'T52')
   TABLE_ENTRIES_COMBO = 'T36'
-  TABLE_ROWS = ['T30', 'T31', 'T32', 'T33', 'T34', 'T35']
+  TABLE_ROWS = ('T30', 'T31', 'T32', 'T33', 'T34', 'T35')
   TABLE_NEXT = 'T37'
   OTHER_NUMBER = 'T54' #Same task serves for both alternative agenda item number in both table and item contexts
 
-  page_number = page_data['page']
+  def __init__(self, page_number, results, out = print):
+    self.page_number = page_number
+    self.results = results
+    self.out = out
+    self.counter = 0
+    self.row_number = 0
+    self.item_number = None
+    self.title = None
 
-  if task == TABLE_HEADERS_COMBO:
-    proc_tables.counter += 1
-    proc_tables.row_number = 0
-    proc_tables.item_number = get_dropdown_textbox_value(TABLE_STANDARD_NUMBER, value[0], OTHER_NUMBER, value[1])
-    proc_tables.title = get_value(TABLE_TITLE, value[2])
+  def parse(self, task, value):
+    handler = self.TASKS.get(task)
+    if handler is None: exit(f'Unknown task: {task}\n{value}')
+    handler(self, value)
 
-    headings = [get_value(x, y) for x, y in zip(TABLE_COL_HEAD, value[3:])] #This will match each task to the particular value
+  def proc_headers(self, value):
+    self.counter += 1
+    self.row_number = 0
+    self.item_number = get_dropdown_textbox_value(self.TABLE_STANDARD_NUMBER, value[0], self.OTHER_NUMBER, value[1])
+    self.title = get_value(self.TABLE_TITLE, value[2])
 
-    print(f"Table {proc_tables.counter} in item {proc_tables.item_number}")
-    print(f'\033[4m{proc_tables.title}\033[0m')
-    for x in headings:
-      if len(x) == 0: break
-      print(f'\033[4m{x}\033[0m', end = ',')
-    print()
-    tables.append([page_number, proc_tables.item_number, proc_tables.counter, proc_tables.title, proc_tables.row_number, *headings]) #row 0 signifies the headings -- there may not be any, in which case those 6 cells will be empty
-  elif task == TABLE_ENTRIES_COMBO:
-    proc_tables.row_number += 1
-    cells = [get_value(x, y) for x, y in zip(TABLE_ROWS, value)]
+    headings = [get_value(x, y) for x, y in zip(self.TABLE_COL_HEAD, value[3:])] #This will match each task to the particular value
+
+    self.out(f"Table {self.counter} in item {self.item_number}")
+    self.out(f'\033[4m{self.title}\033[0m')
+    if self.out:
+      for x in headings:
+        if len(x) == 0: break
+        self.out(f'\033[4m{x}\033[0m', end = ',')
+      self.out()
+    self.results.minutes_tables.append(TablesRecord(self.page_number, self.item_number, self.counter, self.title, self.row_number, *headings)) #row 0 signifies the headings -- there may not be any, in which case those 6 cells will be empty
+
+  def proc_entries(self, value):
+    self.row_number += 1
+    cells = [get_value(x, y) for x, y in zip(self.TABLE_ROWS, value)]
     for x in cells:
       if len(x) == 0: break
-      print(x, end = ',')
-      tables.append([page_number, proc_tables.item_number, proc_tables.counter, proc_tables.title, proc_tables.row_number, *cells])
-    print()
-  elif task == TABLE_NEXT:
+      self.out(x, end = ',')
+      self.results.minutes_tables.append(TablesRecord(self.page_number, self.item_number, self.counter, self.title, self.row_number, *cells))
+    self.out()
+
+  def proc_next(self, value):
     if value == 'Another row': None
     elif value == 'Another table':
-      print()
-      proc_tables.row_number = 0
+      self.out()
+      self.row_number = 0
     elif value[0:8] == 'Nothing:':
-      proc_tables.counter = 0
-      print()
+      self.counter = 0
+      self.out()
     else: raise Exception('Bad value')
-  else: exit(f'Unknown task: {task}\n{value}')
 
-def proc_minutes(table_function, page_data, annotations, attendees, tables, items, comments):
+  TASKS = {
+    TABLE_HEADERS_COMBO: proc_headers,
+    TABLE_ENTRIES_COMBO: proc_entries,
+    TABLE_NEXT: proc_next,
+  }
+
+#Parses one page of a minutes workflow, handing any table tasks on to a table parser of the given class
+#All parsing state lives on the instance (and on its table parser), so independent instances can run side by side
+#With a profile, the table parser's time is a stage of its own (named for its class), which is also
+#within the time of the page handler
+class MinutesParser:
+  __slots__ = ('page_number', 'results', 'out', 'table_parser', 'profile', 'table_stage')
+
   STANDARD_ATTENDEES = 'T9'
   OTHER_ATTENDEES = 'T3'
   STANDARD_AGENDA = 'T14'
@@ -330,197 +568,1252 @@ def proc_minutes(table_function, page_data, annotations, attendees, tables, item
   AGENDA_CLASSIFICATION = 'T10'
 
   COMMENTS = 'T28'
-  SKIP = ['T8', 'T15', 'T55'] #T8: 'Is there a table on the page?'
+  SKIP = ('T8', 'T15', 'T55') #T8: 'Is there a table on the page?'
                               #T15: 'Are there any non-standard minutes to transcribe?'
                               #T55: 'Is there another agenda item to transcribe?'
 
-  page_number = int(page_data['page'])
-  entry = 0
-  table_function.counter = 0
-  for annotation in annotations:
-    task = annotation['task']
-    value = annotation['value']
-    if task == STANDARD_ATTENDEES:
-      print('\033[4mAttendees\033[0m')
-      print('\n'.join(value))
-      for x in value: attendees.append([page_number, x.strip()])
-    elif task == OTHER_ATTENDEES:
-      if len(value):
-        print(value)
-        for x in value.split('\n'):
-          attendees.append([page_number, x.strip()])
-    elif task == STANDARD_AGENDA:
-      print('\n\033[4mAgenda Items\033[0m')
-      print('\n'.join(value))
-      for x in value:
-        items.append([page_number, int(x[0]), None, x[3:x.index(':')], x[x.index(':') + 1:], 'Front Page Item'])
-    elif task == AGENDA_COMBO:
-      number = get_dropdown_textbox_value(AGENDA_STANDARD_NUMBER, value[0], OTHER_NUMBER, value[1])
-      try:
-        number = int(number)
-      except ValueError:
-        sys.stderr.write(f'Item "{number}" on p. {page_number} is not an integer\n')
-      title, text, resolution, classification = [get_value(x, y) for x, y in \
-        zip([AGENDA_TITLE, AGENDA_TEXT, AGENDA_RESOLUTION, AGENDA_CLASSIFICATION], value[2:])]
-      print(f'{number}. ', end = '')
-      if len(title): print(f'\033[4m{title}\033[0m ', end = '') #TODO: This should be empty, requires a fixup if it exists.
-      if len(classification): print(f'\033[3m{classification}\033[0m', end = '')
-      if len(title) or len(classification): print()
-      print('\033[3mText\033[0m')
+  def __init__(self, table_parser_class, page_data, results, out = print, profile = Profile()):
+    self.page_number = int(page_data['page'])
+    self.results = results
+    self.out = out
+    self.table_parser = table_parser_class(page_data['page'], results, out)
+    self.profile = profile
+    self.table_stage = f'{table_parser_class.__name__}.parse'
+
+  def parse(self, annotations):
+    for annotation in annotations:
+      task = annotation['task']
+      handler = self.TASKS.get(task)
+      if handler is None:
+        with self.profile.stage(self.table_stage): self.table_parser.parse(task, annotation['value'])
+      else: handler(self, annotation['value'])
+
+  def proc_standard_attendees(self, value):
+    if self.out:
+      self.out('\033[4mAttendees\033[0m')
+      self.out('\n'.join(value))
+    for x in value: self.results.minutes_attendees.append(AttendeesRecord(self.page_number, x.strip()))
+
+  def proc_other_attendees(self, value):
+    if len(value):
+      self.out(value)
+      for x in value.split('\n'):
+        self.results.minutes_attendees.append(AttendeesRecord(self.page_number, x.strip()))
+
+  def proc_standard_agenda(self, value):
+    if self.out:
+      self.out('\n\033[4mAgenda Items\033[0m')
+      self.out('\n'.join(value))
+    for x in value:
+      self.results.minutes_items.append(ItemsRecord(self.page_number, int(x[0]), None, x[3:x.index(':')], x[x.index(':') + 1:], 'Front Page Item'))
+
+  def proc_agenda(self, value):
+    number = get_dropdown_textbox_value(self.AGENDA_STANDARD_NUMBER, value[0], self.OTHER_NUMBER, value[1])
+    try:
+      number = int(number)
+    except ValueError:
+      sys.stderr.write(f'Item "{number}" on p. {self.page_number} is not an integer\n')
+    title, text, resolution, classification = [get_value(x, y) for x, y in \
+      zip([self.AGENDA_TITLE, self.AGENDA_TEXT, self.AGENDA_RESOLUTION, self.AGENDA_CLASSIFICATION], value[2:])]
+    if self.out:
+      self.out(f'{number}. ', end = '')
+      if len(title): self.out(f'\033[4m{title}\033[0m ', end = '') #TODO: This should be empty, requires a fixup if it exists.
+      if len(classification): self.out(f'\033[3m{classification}\033[0m', end = '')
+      if len(title) or len(classification): self.out()
+      self.out('\033[3mText\033[0m')
       if len(text):
-        print(text)
-        print()
-      print('\033[3mResolution\033[0m')
-      print(resolution)
-      print()
-      items.append([page_number, number, title, text, resolution, classification])
-    elif task == COMMENTS:
-      if len(value.strip()) != 0:
-        print(f'Comments: {value}')
-        comments.append([page_number, value])
-    elif task in SKIP: continue
-    else: table_function(page_data, task, value, tables)
-
-def proc_underlining(page, annotations, lines):
-  UNDERLININGS = 'T0'
-
-  page_number = page['page']
+        self.out(text)
+        self.out()
+      self.out('\033[3mResolution\033[0m')
+      self.out(resolution)
+      self.out()
+    self.results.minutes_items.append(ItemsRecord(self.page_number, number, title, text, resolution, classification))
+
+  def proc_comments(self, value):
+    if len(value.strip()) != 0:
+      self.out(f'Comments: {value}')
+      self.results.comments.append(CommentsRecord(self.page_number, value))
+
+  def proc_skip(self, value): pass
+
+  TASKS = {
+    STANDARD_ATTENDEES: proc_standard_attendees,
+    OTHER_ATTENDEES: proc_other_attendees,
+    STANDARD_AGENDA: proc_standard_agenda,
+    AGENDA_COMBO: proc_agenda,
+    COMMENTS: proc_comments,
+    **dict.fromkeys(SKIP, proc_skip),
+  }
+
+UNDERLININGS = 'T0'
+
+def proc_underlining(page, annotations, lines, out = print):
+  page_number = int(page['page'])
   for annotation in annotations:
     task = annotation['task']
     value = annotation['value']
     if task == UNDERLININGS:
-      underlinings = [[],[],[]]
-      for v in value:
-        underlinings[int(v['tool'])].append(((v['x1'], v['y1']), (v['x2'], v['y2'])))
-      print('Titles')
-      for line in underlinings[UnderlineType.TITLE.value]: print(line)
-      print('Texts')
-      for line in underlinings[UnderlineType.TEXT.value]: print(line)
-      print('Resolutions')
-      for line in underlinings[UnderlineType.RESOLUTION.value]: print(line)
-      for line_type in UnderlineType:
-        for line in underlinings[line_type.value]:
-          lines.append([page_number, line_type.name, *line[0], *line[1]])
+      if out:
+        underlinings = [[],[],[]]
+        for v in value:
+          underlinings[int(v['tool'])].append(((v['x1'], v['y1']), (v['x2'], v['y2'])))
+        out('Titles')
+        for line in underlinings[UnderlineType.TITLE.value]: out(line)
+        out('Texts')
+        for line in underlinings[UnderlineType.TEXT.value]: out(line)
+        out('Resolutions')
+        for line in underlinings[UnderlineType.RESOLUTION.value]: out(line)
+      lines.extend_columns(page_number, [int(v['tool']) for v in value],
+                           [v['x1'] for v in value], [v['y1'] for v in value], [v['x2'] for v in value], [v['y2'] for v in value])
     else: exit(f'Unknown task: {task}\n{value}')
 
+#Underlining segments, held column by column in typed arrays rather than as a list per segment
+#Iterating gives the same [page, type name, x1, y1, x2, y2] rows as the other output tables use
+#Coordinates stay double precision: not all of them survive a round trip through float32
+class Lines:
+  __slots__ = ('page', 'type', 'x1', 'y1', 'x2', 'y2')
+
+  def __init__(self):
+    self.page = array.array('i')
+    self.type = array.array('b')
+    self.x1 = array.array('d')
+    self.y1 = array.array('d')
+    self.x2 = array.array('d')
+    self.y2 = array.array('d')
+
+  def __len__(self): return len(self.page)
+
+  def __iter__(self):
+    for page, line_type, x1, y1, x2, y2 in zip(self.page, self.type, self.x1, self.y1, self.x2, self.y2):
+      yield [page, UnderlineType(line_type).name, x1, y1, x2, y2]
+
+  #Add the segments of one page, given a column of values for each field
+  def extend_columns(self, page, line_types, x1, y1, x2, y2):
+    self.page.extend([page] * len(line_types))
+    self.type.extend(line_types)
+    self.x1.extend(x1)
+    self.y1.extend(y1)
+    self.x2.extend(x2)
+    self.y2.extend(y2)
 
-parser = argparse.ArgumentParser(
-  description='''Aggregate data from S&B workflows''',
-  epilog="Example: ./aggregate.py",
-  formatter_class=argparse.RawTextHelpFormatter
-)
-parser.add_argument('classifications', nargs='?', default='scarlets-and-blues-classifications.csv', help='Classifications file (default: scarlets-and-blues-classifications.csv)')
-parser.add_argument('-d', '--dump', action='store_true', help='Dump raw JSON')
-parser.add_argument('-w', '--workflow', nargs='*', default=[])
-args = parser.parse_args()
-
-workflow_list = []
-for x in args.workflow:
-  parts = x.split(':')
-  if len(parts) == 4:
-    if parts[0] in WORKFLOWS:
-      print(f'Warning: replacing {parts[0]} in WORKFLOWS')
-    workflow_list.append(parts[0])
-    WORKFLOWS[parts[0]] = {
-      'type': WorkflowType[parts[1].upper()],
-      'id': int(parts[2]),
-      'version': float(parts[3]),
-    }
-  elif len(parts) == 1:
-    workflow_list.append(parts[0])
+  def extend(self, other):
+    if isinstance(other, Lines):
+      for x in self.__slots__: getattr(self, x).extend(getattr(other, x))
+    else:
+      for page, line_type, x1, y1, x2, y2 in other:
+        self.extend_columns(int(page), [UnderlineType[line_type].value], [x1], [y1], [x2], [y2])
+
+  #The segments as a DataFrame, sorted by page and then by UnderlineType (stably, so that segments of the
+  #same page and type stay in the order in which they were added)
+  def frame(self, columns):
+    import numpy as np
+    import pandas as pd
+    page = np.frombuffer(self.page, dtype = np.int32)
+    line_type = np.frombuffer(self.type, dtype = np.int8)
+    order = np.lexsort((line_type, page))
+    line_type_names = np.array([x.name for x in UnderlineType])
+    return pd.DataFrame(dict(zip(columns, [page[order], line_type_names[line_type[order]],
+                                           *[np.frombuffer(getattr(self, x))[order] for x in ('x1', 'y1', 'x2', 'y2')]])))
+
+#Output rows held in memory up to a limit, beyond which they are sorted and spilled to a run file
+#sorted_rows() then k-way merges the runs, so output size does not set the memory ceiling
+#At most FAN_IN runs are merged at once, each read back a block of limit // FAN_IN rows at a time, so the
+#merge holds no more than about limit rows, and has no more than FAN_IN run files open
+class SpillingTable:
+  __slots__ = ('new_buffer', 'buffer', 'limit', 'block', 'key', 'directory', 'runs', 'spilled')
+  FAN_IN = 16
+
+  def __init__(self, new_buffer, limit, key, directory):
+    self.new_buffer = new_buffer
+    self.buffer = new_buffer()
+    self.limit = limit
+    self.block = max(1, limit // self.FAN_IN) #Rows pickled together in a run file
+    self.key = key
+    self.directory = directory
+    self.runs = []
+    self.spilled = 0
+
+  def __len__(self):
+    return self.spilled + len(self.buffer)
+
+  def append(self, row):
+    self.buffer.append(row)
+    if len(self.buffer) >= self.limit: self.spill()
+
+  def extend(self, rows):
+    self.buffer.extend(rows)
+    if len(self.buffer) >= self.limit: self.spill()
+
+  def extend_columns(self, *columns):
+    self.buffer.extend_columns(*columns)
+    if len(self.buffer) >= self.limit: self.spill()
+
+  def spill(self):
+    self.runs.append(self.write_run(sorted(self.buffer, key = self.key)))
+    self.spilled += len(self.buffer)
+    self.buffer = self.new_buffer()
+
+  #Write the (sorted) rows to a new run file, returning its path
+  def write_run(self, rows):
+    with tempfile.NamedTemporaryFile(dir = self.directory, delete = False) as f:
+      for block in batches(rows, self.block): pickle.dump(block, f, pickle.HIGHEST_PROTOCOL)
+    return f.name
+
+  @staticmethod
+  def read_run(path):
+    with open(path, 'rb') as f:
+      while True:
+        try: yield from pickle.load(f)
+        except EOFError: return
+
+  def merge(self, runs):
+    return heapq.merge(*[self.read_run(x) for x in runs], key = self.key)
+
+  #Once anything has been spilled, what is still in memory is spilled too, and then runs are merged, FAN_IN
+  #at a time, into new runs until there are no more than FAN_IN, which are merged as the rows are read
+  #Runs are merged in the order they were spilled, and heapq.merge prefers earlier inputs on ties,
+  #so rows with equal keys stay in the order they were produced
+  def sorted_rows(self):
+    if not self.runs: return iter(sorted(self.buffer, key = self.key))
+    if len(self.buffer): self.spill()
+    while len(self.runs) > self.FAN_IN:
+      runs = []
+      for i in range(0, len(self.runs), self.FAN_IN):
+        group = self.runs[i:i + self.FAN_IN]
+        if len(group) == 1:
+          runs.extend(group)
+          continue
+        runs.append(self.write_run(self.merge(group)))
+        for x in group: os.remove(x)
+      self.runs = runs
+    return self.merge(self.runs)
+
+#Order of a value within a sort column, as pandas sorts an object column: numbers, then strings, then missing
+def sort_value(x):
+  if x is None: return (2, 0)
+  if isinstance(x, str): return (1, x)
+  return (0, x)
+
+#Accumulated output rows, one list (or, for lines, one Lines) per output table
+#With spill, each is instead a SpillingTable holding at most that many rows in memory
+class Results:
+  TABLES = ('index_other', 'index_name', 'minutes_attendees', 'minutes_tables', 'minutes_items', 'comments', 'lines')
+  __slots__ = TABLES + ('spill_directory',)
+
+  def __init__(self, spill = None):
+    for x in self.TABLES: setattr(self, x, [])
+    self.lines = Lines()
+    self.spill_directory = None
+    if spill is not None:
+      self.spill_directory = tempfile.TemporaryDirectory(prefix = 'aggregate-')
+      for table in OUTPUT_TABLES.values():
+        new_buffer = Lines if table['results'] == 'lines' else list
+        setattr(self, table['results'], SpillingTable(new_buffer, spill, row_key(table), self.spill_directory.name))
+
+  def extend(self, other):
+    for x in self.TABLES: getattr(self, x).extend(getattr(other, x))
+
+def proc_index_page(workflow_data, page, control, annotations, results, out = print, profile = Profile()):
+  if control == 'Other page':
+    IndexParser(page, results, out).parse(annotations)
+  elif control == 'Name list':
+    NamesParser(page, results, out).parse(annotations)
+  elif control == 'Blank page':
+    out('*** BLANK ***') #TODO: Probably should make sure that Blank classifications are consistent
+    return
+  else: exit(f"Bad control switch: \"{control}\"")
+  out()
+
+def proc_minutes_page(workflow_data, page, control, annotations, results, out = print, profile = Profile()):
+  if control == 'Blank page':
+    out('*** BLANK ***') #TODO: Probably should make sure that Blank classifications are consistent
+    return
+  if workflow_data.get('alpha'):
+    if control == 'Front page, with attendance list' or \
+       control == 'Other page':
+      MinutesParser(AlphaTableParser, page, results, out, profile).parse(annotations)
+    else: exit(f"Bad control switch for alpha workflows: \"{control}\"")
   else:
-    exit(f'Bad args: workflow argument {parts} must have 1 or 3 parts')
-if len(workflow_list) == 0: workflow_list = WORKFLOWS.keys()
-
-classifications = pd.read_csv(args.classifications)
-
-index_other = []
-index_name = []
-minutes_attendees = []
-minutes_items = []
-minutes_tables = []
-comments = []
-lines = []
-for workflow in workflow_list:
-  workflow_data = WORKFLOWS[workflow]
+    if control == 'Front page, with attendance list' or \
+       control == 'Another page of meeting minutes':
+      MinutesParser(TableParser, page, results, out, profile).parse(annotations)
+    else: exit(f"Bad control switch: \"{control}\"")
+  out()
+
+def proc_underlining_page(workflow_data, page, control, annotations, results, out = print, profile = Profile()):
+  if control == 'Yes, this page is suitable for underlining.':
+    proc_underlining(page, annotations, results.lines, out)
+  elif control == 'No, this page is not suitable for underlining.':
+    out('*** UNSUITABLE ***') #TODO: Probably should make sure that Unsuitable classifications are consistent
+  elif optional_control(workflow_data) and control == None:
+    out('*** UNSUITABLE ***') #In the Alpha workflow, the first question was not flagged required and so this could be None
+  else: exit(f'Bad control switch: "{control}"')
+
+PAGE_HANDLERS = {
+  WorkflowType.INDEX: proc_index_page,
+  WorkflowType.MINUTES: proc_minutes_page,
+  WorkflowType.UNDERLINING: proc_underlining_page,
+}
+
+#Peak resident set size of this process (or, with children, the largest of its finished worker processes)
+def peak_rss_mb(children = False):
+  import resource
+  return resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss / 1024 #ru_maxrss is in KB on Linux
+
+#Columns of the classifications export that the aggregation actually uses, and those that it uses if present
+CLASSIFICATION_COLUMNS = ['workflow_id', 'workflow_version', 'annotations', 'subject_data']
+OPTIONAL_CLASSIFICATION_COLUMNS = ['classification_id', 'subject_ids']
+
+#One selected row of the export
+#classification_id and subject_ids are None if the export does not have those columns
+#page is the page already parsed from subject_data, if it has been (as in a Store), and otherwise None
+Classification = collections.namedtuple('Classification', ['classification_id', 'subject_ids', 'subject_data', 'annotations', 'page'],
+                                        defaults = [None])
+
+#Read the classifications export as a sequence of DataFrames
+#With a chunksize, the file is streamed chunksize rows at a time, so that only the selected rows need be
+#kept and peak memory is set by the selected workflows rather than by the whole export
+def read_classifications(path, chunksize = None):
+  import pandas as pd
+  usecols = lambda x: x in CLASSIFICATION_COLUMNS or x in OPTIONAL_CLASSIFICATION_COLUMNS
+  if chunksize is None: yield pd.read_csv(path, usecols = usecols)
+  else: yield from pd.read_csv(path, chunksize = chunksize, usecols = usecols)
+
+#Route the rows of the export to the selected workflows in a single pass
+#Returns a dict from workflow name to a list of Classifications, in export order
+def select_classifications(path, workflow_list, chunksize = None, profile = Profile(), workflows = WORKFLOWS):
+  #(workflow_id, workflow_version) -> names of the selected workflows with that id and version
+  lookup = {}
+  for workflow in workflow_list:
+    lookup.setdefault((workflows[workflow]['id'], workflows[workflow]['version']), []).append(workflow)
+  selected = {workflow: [] for workflow in workflow_list}
+  for chunk in profile.iterate('load', read_classifications(path, chunksize), len):
+    with profile.stage('filter', len(chunk)):
+      missing = [None] * len(chunk)
+      for key, *row in zip(zip(chunk['workflow_id'].tolist(), chunk['workflow_version'].tolist()),
+                           chunk['classification_id'].tolist() if 'classification_id' in chunk else missing,
+                           chunk['subject_ids'].tolist() if 'subject_ids' in chunk else missing,
+                           chunk['subject_data'].tolist(), chunk['annotations'].tolist()):
+        for workflow in lookup.get(key, ()): selected[workflow].append(Classification(*row))
+  return selected
+
+#Only 'page' is used from the subject metadata: where the subject_data JSON has exactly one plain
+#"page" key, it is pulled out directly rather than by decoding the whole of the JSON
+SUBJECT_PAGE = re.compile(r'"page"\s*:\s*(?:"([^"\\]*)"|(\d+)\s*[,}])')
+
+def subject_page(subject_data):
+  matches = SUBJECT_PAGE.findall(subject_data)
+  if len(matches) == 1:
+    text, number = matches[0]
+    return {'page': int(number) if number else text}
+  return subject_metadata(subject_data)
+
+#Load a dict from the subject_data JSON, then drop the key, leaving only the dict that the key pointed to
+#(there is only ever one value in these dicts)
+def subject_metadata(subject_data):
+  return next(iter(json_loads(subject_data).values()))
+
+#Lazily read the annotations as a sequence of (subject_data, annotation) tuples, so that only one page at
+#a time need be held decoded
+#Unless full_subject is set, the subject_data dict holds only the page
+def decode_pages(rows, full_subject = False):
+  decode_subject = subject_metadata if full_subject else subject_page
+  for row in rows:
+    if row.page is None or full_subject: yield decode_subject(row.subject_data), json_loads(row.annotations)
+    else: yield {'page': row.page}, json_loads(row.annotations)
+
+#Print the pages as a JSON list, exactly as json.dumps(pages, indent=2) would, but one page at a time
+def dump_pages(pages):
+  separator = '['
+  for page in pages:
+    print(separator)
+    print('\n'.join(['  ' + x for x in json.dumps(page, indent=2).split('\n')]), end = '')
+    separator = ','
+  print('[]' if separator == '[' else '\n]')
+
+#A classifications export converted, once, for repeated runs: an SQLite file holding the rows clustered by
+#workflow id and version (so that selecting workflows reads only their rows) in export order, with the
+#page already parsed from subject_data, and indexed on subject_ids
+class Store:
+  __slots__ = ('connection',)
+  MAGIC = b'SQLite format 3\0'
+
+  def __init__(self, path):
+    self.connection = sqlite3.connect(path)
+
+  @classmethod
+  def is_store(cls, path):
+    with open(path, 'rb') as f: return f.read(len(cls.MAGIC)) == cls.MAGIC
+
+  #Columns without a type keep the type of what is stored in them, so ids and pages come back as they went in
+  @classmethod
+  def convert(cls, export_path, path, chunksize = 10000):
+    if os.path.exists(path): exit(f'Store {path} already exists')
+    store = cls(path)
+    store.connection.execute('''CREATE TABLE classifications (
+                                  workflow_id INTEGER NOT NULL,
+                                  workflow_version REAL NOT NULL,
+                                  row INTEGER NOT NULL,
+                                  classification_id,
+                                  subject_ids,
+                                  page,
+                                  subject_data TEXT NOT NULL,
+                                  annotations TEXT NOT NULL,
+                                  PRIMARY KEY (workflow_id, workflow_version, row)) WITHOUT ROWID''')
+    row = 0
+    for chunk in read_classifications(export_path, chunksize):
+      missing = [None] * len(chunk)
+      subject_data = chunk['subject_data'].tolist()
+      store.connection.executemany('INSERT INTO classifications VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+        zip(chunk['workflow_id'].tolist(), chunk['workflow_version'].tolist(), range(row, row + len(chunk)),
+            chunk['classification_id'].tolist() if 'classification_id' in chunk else missing,
+            chunk['subject_ids'].tolist() if 'subject_ids' in chunk else missing,
+            [subject_page(x).get('page') for x in subject_data], subject_data, chunk['annotations'].tolist()))
+      row += len(chunk)
+    store.connection.execute('CREATE INDEX classifications_subject ON classifications (workflow_id, workflow_version, subject_ids)')
+    store.connection.commit()
+    return store
+
+  #As select_classifications
+  def select(self, workflow_list, profile = Profile(), workflows = WORKFLOWS):
+    selected = {}
+    for workflow in workflow_list:
+      rows = self.connection.execute(
+        '''SELECT classification_id, subject_ids, subject_data, annotations, page FROM classifications
+           WHERE workflow_id = ? AND workflow_version = ? ORDER BY row''',
+        (workflows[workflow]['id'], workflows[workflow]['version']))
+      selected[workflow] = [Classification(*x) for x in profile.iterate('load', rows)]
+    return selected
+
+  def close(self): self.connection.close()
+
+#Sink for the human-readable transcript, called like print()
+#A quiet transcript is falsy, so that handlers can skip building anything that would only be printed
+#In jsonl format, each page's transcript is written as one JSON object per line instead of as plain text
+class Transcript:
+  __slots__ = ('quiet', 'jsonl')
+
+  def __init__(self, quiet = False, jsonl = False):
+    self.quiet = quiet
+    self.jsonl = jsonl
+
+  def __bool__(self): return not self.quiet
+
+  def __call__(self, *args, **kwargs):
+    if not self.quiet: print(*args, **kwargs)
+
+  def heading(self, text):
+    if not self.quiet and not self.jsonl: print(text)
+
+  @contextlib.contextmanager
+  def page(self, workflow_data, page):
+    if self.quiet or not self.jsonl:
+      yield
+      return
+    with contextlib.redirect_stdout(io.StringIO()) as text:
+      yield
+    sys.stdout.write(json.dumps({'workflow_id': workflow_data['id'], 'workflow_version': workflow_data['version'],
+                                 'page': page['page'], 'transcript': text.getvalue()}) + '\n')
+
+#Read the transcription of one decoded page (using our knowledge about the workflows)
+#The profile times each handler, separately for each control switch value (which picks the parser)
+def proc_page(workflow_data, page, annotations, results, transcript = Transcript(), profile = Profile()):
   workflow_type = workflow_data['type']
-  #Heading
-  print(f'### {workflow} ({workflow_type.name}) {workflow_data["version"]} ({os.path.basename(args.classifications)})')
-
-  workflow_classifications = classifications.loc[(classifications['workflow_id'] == workflow_data['id']) &
-                                                 (classifications['workflow_version'] == workflow_data['version'])]
-
-  #Read the annotations into an array of (subject_data, annotation) tuples
-  pages = [ (
-              next(iter(json.loads(row['subject_data']).values())), #Load a dict from the subject_data JSON, then drop the key,
-                                                                    #leaving only the dict that the key pointed to (there is only
-                                                                    #ever one value in these dicts)
-              json.loads(row['annotations'])
-            )
-            for index, row in workflow_classifications.iterrows() ]
-
-  if args.dump: print(json.dumps(pages, indent=2))
-
-  #Read the transcriptions (using our knowledge about the workflows)
-  for (page, annotations) in pages:
-    print(f'* Page: {page["page"]}')
+  with transcript.page(workflow_data, page):
+    transcript(f'* Page: {page["page"]}')
+    profile.count_tasks(annotations)
     control = annotations.pop(0)['value'] #Our workflows all start with a control flow question
-    if workflow_type == WorkflowType.INDEX:
-      if control == 'Other page':
-        proc_index_other(page, annotations, index_other, comments)
-      elif control == 'Name list':
-        proc_index_names(page, annotations, index_name, index_other, comments)
-      elif control == 'Blank page':
-        print('*** BLANK ***') #TODO: Probably should make sure that Blank classifications are consistent
-        continue
-      else: exit(f"Bad control switch: \"{control}\"")
-      print()
-    elif workflow_type == WorkflowType.MINUTES:
-      if control == 'Blank page':
-        print('*** BLANK ***') #TODO: Probably should make sure that Blank classifications are consistent
-        continue
-      if (workflow_data['id'] == 16890 and workflow_data['version'] == 4.9) or \
-         (workflow_data['id'] == 16863 and workflow_data['version'] == 19.48):
-        if control == 'Front page, with attendance list' or \
-           control == 'Other page':
-          proc_minutes(proc_tables_alpha, page, annotations, minutes_attendees, minutes_tables, minutes_items, comments)
-        else: exit(f"Bad control switch for alpha workflows: \"{control}\"")
-      else:
-        if control == 'Front page, with attendance list' or \
-           control == 'Another page of meeting minutes':
-          proc_minutes(proc_tables, page, annotations, minutes_attendees, minutes_tables, minutes_items, comments)
-        else: exit(f"Bad control switch: \"{control}\"")
-      print()
-    elif workflow_type == WorkflowType.UNDERLINING:
-      if control == 'Yes, this page is suitable for underlining.':
-        proc_underlining(page, annotations, lines)
-      elif control == 'No, this page is not suitable for underlining.':
-        print('*** UNSUITABLE ***') #TODO: Probably should make sure that Unsuitable classifications are consistent
-      elif (workflow_data['id'] == 16848 and workflow_data['version'] < 19.81) and control == None:
-        print('*** UNSUITABLE ***') #In the Alpha workflow, the first question was not flagged required and so this could be None
-      else: exit(f'Bad control switch: "{control}"')
+    if not workflow_type in PAGE_HANDLERS: exit(f'Bad workflow type: "{workflow_type}"')
+    handler = PAGE_HANDLERS[workflow_type]
+    with profile.stage(f'{handler.__name__}: {control}'):
+      handler(workflow_data, page, control, annotations, results, transcript, profile)
+
+def proc_pages(workflow_data, rows, results, transcript = Transcript(), profile = Profile()):
+  for (page, annotations) in profile.iterate('decode', decode_pages(rows)):
+    proc_page(workflow_data, page, annotations, results, transcript, profile)
+
+#Worker for --jobs: process one shard of a workflow's rows, returning its transcript, results and profile
+#so that the parent can emit them in shard order (which reproduces the serial output exactly)
+def proc_shard(workflow_data, rows, transcript = Transcript(), profile_enabled = False):
+  results = Results()
+  profile = Profile(profile_enabled)
+  with contextlib.redirect_stdout(io.StringIO()) as text:
+    proc_pages(workflow_data, rows, results, transcript, profile)
+  return text.getvalue(), results, profile
+
+#Process a workflow's rows with a pool of worker processes
+#Shards are contiguous runs of rows and are merged back in order, so the transcript and the order of rows
+#within each result list are the same as for a serial run
+#With a profile, the stage times are summed over the workers
+def proc_pages_parallel(executor, jobs, workflow_data, rows, results, transcript = Transcript(), profile = Profile()):
+  shard_size = max(1, -(-len(rows) // (jobs * 4))) #A few shards per worker, to even out uneven pages
+  shards = [rows[i:i + shard_size] for i in range(0, len(rows), shard_size)]
+  for text, shard_results, shard_profile in executor.map(proc_shard, [workflow_data] * len(shards), shards,
+                                                         [transcript] * len(shards), [profile.enabled] * len(shards)):
+    sys.stdout.write(text)
+    results.extend(shard_results)
+    profile.extend(shard_profile)
+
+#Process rows one at a time (in the executor's workers, if there is one), yielding each with its own Results
+def proc_rows(executor, jobs, workflow_data, rows, transcript = Transcript(), profile = Profile()):
+  if executor is None: pool_map = map
+  else: pool_map = functools.partial(executor.map, chunksize = max(1, len(rows) // (jobs * 4)))
+  for row, (text, row_results, row_profile) in zip(rows, pool_map(proc_shard, [workflow_data] * len(rows), [[row] for row in rows],
+                                                                  [transcript] * len(rows), [profile.enabled] * len(rows))):
+    sys.stdout.write(text)
+    profile.extend(row_profile)
+    yield row, row_results
+
+#Key by which a classification is remembered in a checkpoint
+#Exports without a classification_id column fall back to a digest of the row, numbered so that identical
+#rows (which do occur) are still counted separately
+def classification_keys(rows):
+  occurrences = collections.Counter()
+  keys = []
+  for row in rows:
+    if row.classification_id is not None: keys.append(str(row.classification_id))
+    else:
+      digest = hashlib.sha1(f'{row.subject_ids}\0{row.subject_data}\0{row.annotations}'.encode()).hexdigest()
+      keys.append(f'{digest}:{occurrences[digest]}')
+      occurrences[digest] += 1
+  return keys
+
+#SQLite store of the classifications already aggregated, together with the rows extracted from each
+#Rows come back out in the order in which they were added, which for an append-only export is export order
+class Checkpoint:
+  __slots__ = ('connection',)
+
+  def __init__(self, path):
+    self.connection = sqlite3.connect(path)
+    self.connection.execute('''CREATE TABLE IF NOT EXISTS classifications (
+                                 id INTEGER PRIMARY KEY,
+                                 workflow_id INTEGER NOT NULL,
+                                 workflow_version REAL NOT NULL,
+                                 classification TEXT NOT NULL,
+                                 subject_ids TEXT,
+                                 results TEXT NOT NULL,
+                                 UNIQUE (workflow_id, workflow_version, classification))''')
+
+  def keys(self, workflow_data):
+    return {x for x, in self.connection.execute(
+      'SELECT classification FROM classifications WHERE workflow_id = ? AND workflow_version = ?',
+      (workflow_data['id'], workflow_data['version']))}
+
+  def add(self, workflow_data, key, subject_ids, results):
+    self.connection.execute(
+      'INSERT INTO classifications (workflow_id, workflow_version, classification, subject_ids, results) VALUES (?, ?, ?, ?, ?)',
+      (workflow_data['id'], workflow_data['version'], key, None if subject_ids is None else str(subject_ids),
+       json.dumps({x: list(getattr(results, x)) for x in Results.TABLES if len(getattr(results, x))})))
+
+  #Add the stored rows for the given workflow to results, of the classifications stored after the one with
+  #id after (by default, all of them), and return the id of the last one added
+  def load(self, workflow_data, results, after = 0):
+    for after, stored in self.connection.execute(
+      'SELECT id, results FROM classifications WHERE workflow_id = ? AND workflow_version = ? AND id > ? ORDER BY id',
+      (workflow_data['id'], workflow_data['version'], after)):
+      for x, rows in json.loads(stored).items():
+        record = RECORDS.get(x)
+        getattr(results, x).extend(rows if record is None else [record(*row) for row in rows])
+    return after
+
+  def commit(self): self.connection.commit()
+  def close(self): self.connection.close()
+
+#Process only those rows that the checkpoint has not seen before, recording each one's extracted rows
+#The outputs come from the checkpoint, which is loaded (with Checkpoint.load) once everything has been added
+def proc_pages_incremental(checkpoint, executor, jobs, workflow_data, rows, transcript = Transcript(), profile = Profile()):
+  seen = checkpoint.keys(workflow_data)
+  new = [(key, row) for key, row in zip(classification_keys(rows), rows) if not key in seen]
+  for (key, _), (row, row_results) in zip(new, proc_rows(executor, jobs, workflow_data, [row for _, row in new], transcript, profile)):
+    checkpoint.add(workflow_data, key, row.subject_ids, row_results)
+  with profile.stage('checkpoint'): checkpoint.commit()
+
+#The output tables: the Results attribute holding their rows and the record class of a row, their columns
+#(with the dtype used for typed formats) and their sort order, or a function to build the sorted DataFrame
+#from their rows (and a key sorting single rows the same way)
+OUTPUT_TABLES = {
+  'Index': {
+    'results': 'index_other',
+    'record': IndexRecord,
+    'columns': {'Page': 'Int64', 'Entry': 'Int64', 'Heading': 'string', 'Subject': 'string', 'PageRef': 'string', 'Annotation': 'string'},
+    'sort': ['Page', 'Entry'],
+  },
+  'Names': {
+    'results': 'index_name',
+    'record': NamesRecord,
+    'columns': {'Page': 'Int64', 'Entry': 'Int64', 'Title': 'string', 'Forename': 'string', 'Surname': 'string', 'Position': 'string',
+                'Subject': 'string', 'PageRef': 'string', 'Annotation': 'string'},
+    'sort': ['Page', 'Entry'],
+  },
+  'Attendees': {
+    'results': 'minutes_attendees',
+    'record': AttendeesRecord,
+    'columns': {'Page': 'Int64', 'Name': 'string'},
+    'sort': ['Page', 'Name'],
+  },
+  'Tables': {
+    'results': 'minutes_tables',
+    'record': TablesRecord,
+    'columns': {'Page': 'Int64', 'Item': 'string', 'Table': 'Int64', 'Title': 'string', 'Row': 'Int64',
+                'Col1': 'string', 'Col2': 'string', 'Col3': 'string', 'Col4': 'string', 'Col5': 'string', 'Col6': 'string'},
+    'sort': ['Page', 'Item', 'Table', 'Row'],
+  },
+  'Items': {
+    'results': 'minutes_items',
+    'record': ItemsRecord,
+    'columns': {'Page': 'Int64', 'Item': 'string', 'Title': 'string', 'Text': 'string', 'Resolution': 'string', 'Classification': 'string'}, #Item is not always an integer
+    'sort': ['Page', 'Item'],
+  },
+  'Comments': {
+    'results': 'comments',
+    'record': CommentsRecord,
+    'columns': {'Page': 'Int64', 'Comments': 'string'},
+    'sort': 'Page',
+  },
+  'Lines': {
+    'results': 'lines',
+    'columns': {'Page': 'Int64', 'Type': [x.name for x in UnderlineType], #Ordered categorical
+                'x1': 'float64', 'y1': 'float64', 'x2': 'float64', 'y2': 'float64'},
+    'frame': Lines.frame,
+    'key': lambda row: (row[0], UnderlineType[row[1]].value),
+  },
+}
+
+#Record class of each Results attribute that has one
+RECORDS = {x['results']: x['record'] for x in OUTPUT_TABLES.values() if 'record' in x}
+
+#Key sorting one row of an output table as its DataFrame is sorted
+def row_key(table):
+  if 'key' in table: return table['key']
+  sort = table['sort'] if isinstance(table['sort'], list) else [table['sort']]
+  indices = [list(table['columns']).index(x) for x in sort]
+  return lambda row: tuple(sort_value(row[i]) for i in indices)
+
+#Writers take the output in one or more DataFrames, to be written one after the other
+def write_csv(frames, path):
+  for i, df in enumerate(frames):
+    df.to_csv(path_or_buf = path, mode = 'a' if i else 'w', header = not i, index = False)
+
+def write_arrow(frames, path, open_writer):
+  import pyarrow as pa
+  writer = None
+  for df in frames:
+    table = pa.Table.from_pandas(df, preserve_index = False)
+    if writer is None: writer = open_writer(path, table.schema)
+    writer.write_table(table)
+  writer.close()
+
+def parquet_writer(path, schema):
+  import pyarrow.parquet as pq
+  return pq.ParquetWriter(path, schema)
+
+def feather_writer(path, schema):
+  import pyarrow as pa
+  return pa.ipc.new_file(path, schema) #Feather V2 is the Arrow IPC file format
+
+#File extension and writer for each output format
+#The typed formats get the dtypes from OUTPUT_TABLES, rather than whatever pandas infers from the rows
+OUTPUT_FORMATS = {
+  'csv': ('csv', write_csv),
+  'parquet': ('parquet', lambda frames, path: write_arrow(frames, path, parquet_writer)),
+  'feather': ('feather', lambda frames, path: write_arrow(frames, path, feather_writer)),
+}
+
+#Consecutive lists of n items, and one empty list if there are no items (so that the table is still written)
+def batches(iterable, n):
+  iterator = iter(iterable)
+  batch = list(itertools.islice(iterator, n))
+  yield batch
+  while len(batch) == n:
+    batch = list(itertools.islice(iterator, n))
+    if batch: yield batch
+
+#A list of categories as a dtype is an ordered categorical
+def typed(df, dtypes):
+  import pandas as pd
+  for column, dtype in dtypes.items():
+    if isinstance(dtype, list): df[column] = df[column].astype(pd.CategoricalDtype(dtype, ordered = True))
+    elif dtype == 'Int64': df[column] = pd.to_numeric(df[column]).astype(dtype)
+    else: df[column] = df[column].astype(dtype)
+  return df
+
+#One output table, sorted, as a list of one DataFrame or, for a spilled table, a generator of DataFrames
+#that are in order one after the other
+def sorted_frames(results, table):
+  import pandas as pd
+  rows = getattr(results, table['results'])
+  columns = list(table['columns'])
+  if isinstance(rows, SpillingTable):
+    return (pd.DataFrame(x, columns = columns) for x in batches(rows.sorted_rows(), rows.limit))
+  elif 'frame' in table: return [table['frame'](rows, columns)]
+  else: return [pd.DataFrame(rows, columns = columns).sort_values(table['sort'], kind = 'stable')]
+
+#The profile times the sort and the write of each table, counting its rows
+#(For spilled tables, the merge happens as the table is written, so it is all in the write)
+#prefix is prepended to the file names: it may be a directory (ending in /), which is created if need be
+def write_results(results, output_format = 'csv', profile = Profile(), prefix = ''):
+  extension, write = OUTPUT_FORMATS[output_format]
+  if os.path.dirname(prefix): os.makedirs(os.path.dirname(prefix), exist_ok = True)
+  for name, table in OUTPUT_TABLES.items():
+    rows = getattr(results, table['results'])
+    with profile.stage(f'sort {name}', len(rows)): frames = sorted_frames(results, table)
+    with profile.stage(f'write {name}', len(rows)):
+      if output_format != 'csv': frames = (typed(df, table['columns']) for df in frames)
+      write(frames, f'{prefix}{name}.{extension}')
+
+#Consensus of the volunteers who classified the same page (--consensus)
+#Each classification's rows are filed, in one pass, under its workflow, subject and page, and sorted on
+#those (spilling to disk with --spill), so that each group is reduced on its own as the sorted rows pass:
+#rows are matched up across the group's classifications by hashing a normalised key (with a similarity
+#match only for items left unnumbered, and a SegmentIndex for underlining), so no classification is
+#compared with every other. A row is kept when more than CONSENSUS_MAJORITY of the group's
+#classifications have it.
+CONSENSUS_MAJORITY = 0.5
+LINE_TOLERANCE = 40 #Greatest distance, in pixels, between the midpoints of matching segments
+NOT_WORD = re.compile(r'[^\w\s]')
+
+#Key under which transcriptions of the same text match: case, punctuation and spacing are ignored
+def normalise(value):
+  if value is None: return ''
+  return ' '.join(NOT_WORD.sub('', str(value).casefold()).split())
+
+#The most common value, matching on normalise(), spelt as most of its voters spelt it (ties go to the first seen)
+def vote(values):
+  spellings = {}
+  for x in values: spellings.setdefault(normalise(x), []).append(x)
+  return collections.Counter(max(spellings.values(), key = len)).most_common(1)[0][0]
+
+#The value most similar to all of the others, for free text, where few transcriptions match exactly
+def medoid(values):
+  counts = collections.Counter('' if x is None else x for x in values)
+  if len(counts) == 1: return next(iter(counts))
+  return max(counts, key = lambda x: sum(n * difflib.SequenceMatcher(None, x, y).ratio() for y, n in counts.items()))
+
+#Rows of one table across a group's classifications, matched on key(row): key -> [(classification, row)]
+def match_rows(classifications, table, key):
+  matches = {}
+  for i, results in enumerate(classifications):
+    for row in getattr(results, table): matches.setdefault(key(row), []).append((i, row))
+  return matches
+
+def votes(matched): return len({i for i, _ in matched})
+
+def consensus_index(classifications):
+  matches = match_rows(classifications, 'index_other', lambda x: (normalise(x.heading), normalise(x.subject), normalise(x.pageref)))
+  rows = []
+  for matched in matches.values():
+    if votes(matched) <= len(classifications) * CONSENSUS_MAJORITY: continue
+    found = [x for _, x in matched]
+    rows.append([found[0].page, sum(x.entry for x in found) / len(found), vote(x.heading for x in found), vote(x.subject for x in found),
+                 vote(x.pageref for x in found), vote(x.annotation for x in found), votes(matched), len(classifications)])
+  return rows
+
+def consensus_names(classifications):
+  matches = match_rows(classifications, 'index_name', lambda x: (normalise(x.surname), normalise(x.forename), normalise(x.pageref)))
+  rows = []
+  for matched in matches.values():
+    if votes(matched) <= len(classifications) * CONSENSUS_MAJORITY: continue
+    found = [x for _, x in matched]
+    rows.append([found[0].page, sum(x.entry for x in found) / len(found),
+                 *[vote(getattr(x, field) for x in found) for field in ('title', 'forename', 'surname', 'position', 'subject', 'pageref', 'annotation')],
+                 votes(matched), len(classifications)])
+  return rows
+
+def consensus_attendees(classifications):
+  matches = match_rows(classifications, 'minutes_attendees', lambda x: normalise(x.name))
+  return [[matched[0][1].page, vote(x.name for _, x in matched), votes(matched), len(classifications)]
+          for matched in matches.values() if votes(matched) > len(classifications) * CONSENSUS_MAJORITY]
+
+#Items are matched on their number, but volunteers sometimes leave the number blank: such an item joins the
+#item (of another classification) whose title is most similar to its own, if at least ITEM_TITLE_SIMILARITY
+#similar, and is otherwise an item of its own (so blank-numbered items are never matched on the blank)
+ITEM_TITLE_SIMILARITY = 0.8
+
+def match_items(classifications):
+  matches = match_rows(classifications, 'minutes_items', lambda x: normalise(x.item))
+  for i, row in matches.pop('', []):
+    title = normalise(row.title)
+    best = None
+    if title:
+      for key, matched in matches.items():
+        if any(j == i for j, _ in matched): continue
+        similarity = max(difflib.SequenceMatcher(None, title, normalise(x.title)).ratio() for _, x in matched)
+        if similarity >= ITEM_TITLE_SIMILARITY and (best is None or similarity > best[1]): best = (key, similarity)
+    if best is None: matches[(i, len(matches))] = [(i, row)] #A key that no numbered item has
+    else: matches[best[0]].append((i, row))
+  return matches
+
+def consensus_items(classifications):
+  matches = match_items(classifications)
+  rows = []
+  for matched in matches.values():
+    if votes(matched) <= len(classifications) * CONSENSUS_MAJORITY: continue
+    found = [x for _, x in matched]
+    items = [x.item for x in found if normalise(x.item)] or ['']
+    rows.append([found[0].page, vote(items), vote(x.title for x in found), medoid(x.text for x in found),
+                 medoid(x.resolution for x in found), vote(x.classification for x in found), votes(matched), len(classifications)])
+  return rows
+
+#Uniform grid over the bounding boxes of underlining segments (x1, y1, x2, y2), for one page and UnderlineType
+#Each segment is filed under every cell that its box touches, so that a query need only look at the
+#segments in the cells around it: matching up a page's segments is then close to linear in their number
+GRID_CELL = 100 #Pixels
+
+class SegmentIndex:
+  __slots__ = ('segments', 'cell', 'grid', 'bounds')
+
+  def __init__(self, segments, cell = GRID_CELL):
+    self.segments = segments
+    self.cell = cell
+    self.grid = {} #(column, row) -> indices of the segments whose boxes touch that cell
+    for i, segment in enumerate(segments):
+      for key in self.cells(*self.box(segment)): self.grid.setdefault(key, []).append(i)
+    self.bounds = None #(left, top, right, bottom) columns and rows of the cells in use
+    if self.grid:
+      columns, rows = zip(*self.grid)
+      self.bounds = (min(columns), min(rows), max(columns), max(rows))
+
+  @staticmethod
+  def box(segment, margin = 0):
+    x1, y1, x2, y2 = segment
+    return min(x1, x2) - margin, min(y1, y2) - margin, max(x1, x2) + margin, max(y1, y2) + margin
+
+  def cells(self, left, top, right, bottom):
+    return [(column, row) for column in range(int(left // self.cell), int(right // self.cell) + 1)
+                          for row in range(int(top // self.cell), int(bottom // self.cell) + 1)]
+
+  #Indices, in order, of the segments whose boxes overlap the given segment's box grown by margin
+  def overlapping(self, segment, margin = 0):
+    left, top, right, bottom = self.box(segment, margin)
+    found = set()
+    for key in self.cells(left, top, right, bottom): found.update(self.grid.get(key, ()))
+    return sorted(i for i in found if self.overlaps(self.box(self.segments[i]), (left, top, right, bottom)))
+
+  @staticmethod
+  def overlaps(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+  #Index of the segment nearest to the point, and its distance, or None if there are no segments
+  #Rings of cells are searched outwards from the point's cell until no closer segment can be further out
+  def nearest(self, x, y):
+    if not self.grid: return None
+    column, row = int(x // self.cell), int(y // self.cell)
+    left, top, right, bottom = self.bounds
+    extent = max(column - left, right - column, row - top, bottom - row) #Furthest ring with cells in use
+    best = None
+    for ring in range(extent + 1):
+      if best is not None and (ring - 1) * self.cell > best[1]: break
+      for key in self.ring(column, row, ring):
+        for i in self.grid.get(key, ()):
+          distance = point_segment_distance(x, y, self.segments[i])
+          if best is None or distance < best[1] or (distance == best[1] and i < best[0]): best = (i, distance)
+    return best
+
+  #The cells, within bounds, on the edges of the square ring cells out from (column, row)
+  def ring(self, column, row, ring):
+    if ring == 0: return [(column, row)]
+    left, top, right, bottom = self.bounds
+    cells = []
+    for r in (row - ring, row + ring):
+      if top <= r <= bottom: cells.extend((c, r) for c in range(max(left, column - ring), min(right, column + ring) + 1))
+    for c in (column - ring, column + ring):
+      if left <= c <= right: cells.extend((c, r) for r in range(max(top, row - ring + 1), min(bottom, row + ring - 1) + 1))
+    return cells
+
+def point_segment_distance(x, y, segment):
+  x1, y1, x2, y2 = segment
+  dx, dy = x2 - x1, y2 - y1
+  t = 0 if dx == 0 and dy == 0 else max(0, min(1, ((x - x1) * dx + (y - y1) * dy) / (dx * dx + dy * dy)))
+  return ((x - x1 - t * dx) ** 2 + (y - y1 - t * dy) ** 2) ** 0.5
+
+#Underlining segments of each UnderlineType are clustered: each is compared only with the segments that
+#a SegmentIndex finds within LINE_TOLERANCE of it, and joined to those that match
+#Segments match if their midpoints are within LINE_TOLERANCE and they overlap across at least half of
+#the shorter; a cluster is given by the median of each coordinate
+def segments_match(a, b):
+  ax1, ax2 = sorted((a[2], a[4]))
+  bx1, bx2 = sorted((b[2], b[4]))
+  if min(ax2, bx2) - max(ax1, bx1) < min(ax2 - ax1, bx2 - bx1) / 2: return False
+  return ((a[2] + a[4] - b[2] - b[4]) ** 2 + (a[3] + a[5] - b[3] - b[5]) ** 2) / 4 <= LINE_TOLERANCE ** 2
+
+def median(values):
+  values = sorted(values)
+  middle = len(values) // 2
+  return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
+
+#segments are (label, row) pairs, where the row is as from Lines
+def cluster_segments(segments, match):
+  parent = list(range(len(segments)))
+  def root(i):
+    while parent[i] != i:
+      parent[i] = parent[parent[i]]
+      i = parent[i]
+    return i
+  index = SegmentIndex([row[2:6] for _, row in segments])
+  for i, (_, row) in enumerate(segments):
+    for j in index.overlapping(row[2:6], LINE_TOLERANCE):
+      if j > i and match(row, segments[j][1]): parent[root(j)] = root(i)
+  clusters = {}
+  for i in range(len(segments)): clusters.setdefault(root(i), []).append(segments[i])
+  return clusters.values()
+
+def consensus_lines(classifications):
+  by_type = {}
+  for i, results in enumerate(classifications):
+    for row in results.lines: by_type.setdefault(row[1], []).append((i, row))
+  rows = []
+  for line_type, segments in by_type.items():
+    for cluster in cluster_segments(segments, segments_match):
+      if votes(cluster) <= len(classifications) * CONSENSUS_MAJORITY: continue
+      rows.append([cluster[0][1][0], line_type, *[median(x[k] for _, x in cluster) for k in range(2, 6)], votes(cluster), len(classifications)])
+  return rows
+
+#Underlining segments of the same page and UnderlineType, from however many classifications, merged where
+#they match (as for consensus_lines), as rows of Lines_Merged
+def merged_lines(lines):
+  rows = lines.sorted_rows() if isinstance(lines, SpillingTable) else sorted(lines, key = OUTPUT_TABLES['Lines']['key'])
+  merged = []
+  for _, segments in itertools.groupby(rows, key = lambda x: (x[0], x[1])):
+    for cluster in cluster_segments([(None, x) for x in segments], segments_match):
+      merged.append([cluster[0][1][0], cluster[0][1][1], *[median(x[k] for _, x in cluster) for k in range(2, 6)], len(cluster)])
+  return merged
+
+MERGED_LINES_COLUMNS = {'Page': 'Int64', 'Type': [x.name for x in UnderlineType], #Ordered categorical
+                        'x1': 'float64', 'y1': 'float64', 'x2': 'float64', 'y2': 'float64', 'Segments': 'Int64'}
+
+def write_merged_lines(lines, output_format = 'csv', profile = Profile(), prefix = ''):
+  import pandas as pd
+  extension, write = OUTPUT_FORMATS[output_format]
+  with profile.stage('merge Lines', len(lines)): rows = merged_lines(lines)
+  with profile.stage('write Lines_Merged', len(rows)):
+    df = pd.DataFrame(rows, columns = list(MERGED_LINES_COLUMNS))
+    if output_format != 'csv': df = typed(df, MERGED_LINES_COLUMNS)
+    write([df], f'{prefix}Lines_Merged.{extension}')
+
+#The consensus tables: their columns (with the dtype used for typed formats), the function reducing a group
+#of classifications to their rows, and the key to sort the rows by
+#Entry is the mean position on the page of the matched entries
+CONSENSUS_TABLES = {
+  'Consensus_Index': {
+    'columns': {'Page': 'Int64', 'Entry': 'float64', 'Heading': 'string', 'Subject': 'string', 'PageRef': 'string', 'Annotation': 'string',
+                'Votes': 'Int64', 'Classifications': 'Int64'},
+    'consensus': consensus_index,
+    'key': lambda row: (row[0], row[1]),
+  },
+  'Consensus_Names': {
+    'columns': {'Page': 'Int64', 'Entry': 'float64', 'Title': 'string', 'Forename': 'string', 'Surname': 'string', 'Position': 'string',
+                'Subject': 'string', 'PageRef': 'string', 'Annotation': 'string', 'Votes': 'Int64', 'Classifications': 'Int64'},
+    'consensus': consensus_names,
+    'key': lambda row: (row[0], row[1]),
+  },
+  'Consensus_Attendees': {
+    'columns': {'Page': 'Int64', 'Name': 'string', 'Votes': 'Int64', 'Classifications': 'Int64'},
+    'consensus': consensus_attendees,
+    'key': lambda row: (row[0], row[1]),
+  },
+  'Consensus_Items': {
+    'columns': {'Page': 'Int64', 'Item': 'string', 'Title': 'string', 'Text': 'string', 'Resolution': 'string', 'Classification': 'string',
+                'Votes': 'Int64', 'Classifications': 'Int64'},
+    'consensus': consensus_items,
+    'key': lambda row: (row[0], sort_value(row[1])),
+  },
+  'Consensus_Lines': {
+    'columns': {'Page': 'Int64', 'Type': [x.name for x in UnderlineType], #Ordered categorical
+                'x1': 'float64', 'y1': 'float64', 'x2': 'float64', 'y2': 'float64', 'Votes': 'Int64', 'Classifications': 'Int64'},
+    'consensus': consensus_lines,
+    'key': lambda row: (row[0], UnderlineType[row[1]].value, row[3] + row[5]),
+  },
+}
+
+#The rows of one classification of a consensus group, one list for each Results table, as the consensus
+#functions read them
+class Classified:
+  TABLES = Results.TABLES
+  __slots__ = TABLES
+
+  def __init__(self):
+    for x in self.TABLES: setattr(self, x, [])
+
+#Order of Consensus entries: by group, then by classification (and, stably, in the order they were added)
+def consensus_entry_key(entry): return entry[0], entry[1]
+
+#Only the rows extracted from each classification are kept, as (group, classification, table, row) entries,
+#where the group is its (workflow, subject_ids, page) as sort values. With spill, they are held in a
+#SpillingTable, as are the consensus tables' rows, so neither sets the memory ceiling.
+class Consensus:
+  __slots__ = ('spill', 'spill_directory', 'entries', 'classifications')
+
+  def __init__(self, spill = None):
+    self.spill = spill
+    self.spill_directory = None if spill is None else tempfile.TemporaryDirectory(prefix = 'aggregate-')
+    self.entries = self.new_table(consensus_entry_key)
+    self.classifications = 0
+
+  def new_table(self, key):
+    if self.spill is None: return []
+    return SpillingTable(list, self.spill, key, self.spill_directory.name)
+
+  @staticmethod
+  def sorted_rows(rows, key):
+    return rows.sorted_rows() if isinstance(rows, SpillingTable) else iter(sorted(rows, key = key))
+
+  def add(self, workflow, row, results):
+    page = row.page if row.page is not None else subject_page(row.subject_data).get('page')
+    group = tuple(sort_value(x) for x in (workflow, row.subject_ids, page))
+    self.entries.append((group, self.classifications, None, None)) #So that a classification with no rows is still counted
+    for table in Results.TABLES:
+      for x in getattr(results, table): self.entries.append((group, self.classifications, table, x))
+    self.classifications += 1
+
+  #The rows of each consensus table, unsorted: each group is reduced as the sorted entries pass
+  def reduce(self):
+    tables = {name: self.new_table(table['key']) for name, table in CONSENSUS_TABLES.items()}
+    for _, group in itertools.groupby(self.sorted_rows(self.entries, consensus_entry_key), key = lambda x: x[0]):
+      classifications = []
+      for _, entries in itertools.groupby(group, key = lambda x: x[1]):
+        classified = Classified()
+        for _, _, table, row in entries:
+          if table is not None: getattr(classified, table).append(row)
+        classifications.append(classified)
+      for name, table in CONSENSUS_TABLES.items(): tables[name].extend(table['consensus'](classifications))
+    return tables
+
+  #The sorted rows of each consensus table
+  def tables(self):
+    return {name: self.sorted_rows(rows, CONSENSUS_TABLES[name]['key']) for name, rows in self.reduce().items()}
+
+def write_consensus(consensus, output_format = 'csv', profile = Profile(), prefix = ''):
+  import pandas as pd
+  extension, write = OUTPUT_FORMATS[output_format]
+  with profile.stage('consensus', consensus.classifications): tables = consensus.reduce()
+  for name, rows in tables.items():
+    columns = CONSENSUS_TABLES[name]['columns']
+    with profile.stage(f'write {name}', len(rows)):
+      rows = consensus.sorted_rows(rows, CONSENSUS_TABLES[name]['key'])
+      frames = (pd.DataFrame(x, columns = list(columns)) for x in batches(rows, consensus.spill or len(tables[name]) or 1))
+      if output_format != 'csv': frames = (typed(df, columns) for df in frames)
+      write(frames, f'{prefix}{name}.{extension}')
+
+#The aggregation engine, for use as a library as well as by main()
+#It holds the results of everything given to it, across calls, until tables() or write() builds the
+#output tables. Workflows are looked up by name in the given config, which has the shape of WORKFLOWS.
+#With an executor, pages are processed by its jobs worker processes; with a checkpoint, only rows that
+#it has not seen are processed (see proc_pages_incremental), and the outputs are everything it holds for
+#the workflows given rows, loaded when tables() or write() is called.
+#A classification is only aggregated once for each workflow, however many exports it turns up in (where
+#there are classification ids to tell: exports without them may legitimately repeat rows).
+#With consensus, the volunteers' classifications of each page are also reduced to their consensus (this
+#needs each classification's rows separately, so it cannot be used with a checkpoint).
+#With merge_lines, there is also a table of the underlining segments merged where they match.
+class Aggregator:
+  __slots__ = ('workflows', 'transcript', 'results', 'executor', 'jobs', 'checkpoint', 'loaded', 'seen', 'consensus', 'merge_lines')
+
+  def __init__(self, workflows = WORKFLOWS, transcript = Transcript(quiet = True), spill = None,
+               executor = None, jobs = 1, checkpoint = None, consensus = False, merge_lines = False):
+    if consensus and checkpoint is not None: raise Exception('Consensus cannot be used with a checkpoint')
+    self.workflows = workflows
+    self.transcript = transcript
+    self.results = Results(spill)
+    self.executor = executor
+    self.jobs = jobs
+    self.checkpoint = checkpoint
+    self.loaded = {} #workflow name -> id of the last classification in the checkpoint whose rows are in results
+    self.seen = collections.defaultdict(set) #workflow name -> classification ids
+    self.consensus = Consensus(spill) if consensus else None
+    self.merge_lines = merge_lines
+
+  #Rows of the export (or of a Store converted from it), by workflow name, for the given workflows
+  #(default: all of them)
+  def select(self, path, workflow_list = None, chunksize = None, profile = Profile()):
+    if workflow_list is None: workflow_list = list(self.workflows)
+    if Store.is_store(path):
+      store = Store(path)
+      try: return store.select(workflow_list, profile, self.workflows)
+      finally: store.close()
+    return select_classifications(path, workflow_list, chunksize, profile, self.workflows)
+
+  #As select, for each of several exports in turn, yielding (path, rows by workflow name) in the order of paths
+  #The exports are read by a pool of readers threads, which run at most readers exports ahead of the caller:
+  #reading the next exports overlaps with processing the rows of this one, and memory is bounded
+  def select_all(self, paths, workflow_list = None, chunksize = None, profile = Profile(), readers = 2):
+    paths = iter(paths)
+    pending = collections.deque()
+    with concurrent.futures.ThreadPoolExecutor(readers) as pool:
+      def submit():
+        for path in itertools.islice(paths, 1):
+          path_profile = Profile(profile.enabled) #One per thread, merged in as each export is consumed
+          pending.append((path, path_profile, pool.submit(self.select, path, workflow_list, chunksize, path_profile)))
+      for _ in range(readers): submit()
+      while pending:
+        path, path_profile, future = pending.popleft()
+        selected = future.result()
+        profile.extend(path_profile)
+        submit()
+        yield path, selected
+
+  #Add a workflow's rows: Classifications, or mappings from the export's column names (such as the rows of
+  #a csv.DictReader), of which classification_id and subject_ids are optional
+  def add_rows(self, workflow, rows, profile = Profile()):
+    workflow_data = self.workflows[workflow]
+    rows = [x if isinstance(x, Classification) else
+            Classification(x.get('classification_id'), x.get('subject_ids'), x['subject_data'], x['annotations']) for x in rows]
+    seen = self.seen[workflow]
+    new = []
+    for row in rows:
+      if row.classification_id is None: new.append(row)
+      elif not row.classification_id in seen:
+        seen.add(row.classification_id)
+        new.append(row)
+    rows = new
+    if self.checkpoint is not None:
+      sys.stdout.flush()
+      proc_pages_incremental(self.checkpoint, self.executor, self.jobs, workflow_data, rows, self.transcript, profile)
+      self.loaded.setdefault(workflow, 0)
+    elif self.consensus is not None:
+      sys.stdout.flush()
+      for row, row_results in proc_rows(self.executor, self.jobs, workflow_data, rows, self.transcript, profile):
+        self.results.extend(row_results)
+        self.consensus.add(workflow, row, row_results)
+    elif self.executor is None: proc_pages(workflow_data, rows, self.results, self.transcript, profile)
     else:
-      exit(f'Bad workflow type: "{workflow_type}"')
-
-#Index
-pd.DataFrame(index_other, columns = ['Page', 'Entry', 'Heading', 'Subject', 'PageRef', 'Annotation']). \
-  sort_values(['Page', 'Entry']).to_csv(path_or_buf = f'Index.csv', index = False)
-pd.DataFrame(index_name, columns = ['Page', 'Entry', 'Title', 'Forename', 'Surname', 'Position', 'Subject', 'PageRef', 'Annotation']). \
-  sort_values(['Page', 'Entry']).to_csv(path_or_buf = f'Names.csv', index = False)
-
-#Minutes
-pd.DataFrame(minutes_attendees, columns = ['Page', 'Name']). \
-  sort_values(['Page', 'Name']).to_csv(path_or_buf = 'Attendees.csv', index = False)
-pd.DataFrame(minutes_tables, columns = ['Page', 'Item', 'Table', 'Title', 'Row', 'Col1', 'Col2', 'Col3', 'Col4', 'Col5', 'Col6']). \
-  sort_values(['Page', 'Item', 'Table', 'Row']).to_csv(path_or_buf = 'Tables.csv', index = False)
-pd.DataFrame(minutes_items, columns = ['Page', 'Item', 'Title', 'Text', 'Resolution', 'Classification']). \
-  sort_values(['Page', 'Item']).to_csv(path_or_buf = 'Items.csv', index = False)
-
-#Comments
-pd.DataFrame(comments, columns = ['Page', 'Comments']). \
-  sort_values('Page').to_csv(path_or_buf = 'Comments.csv', index = False)
-
-#Lines
-pd.DataFrame(lines, columns = ['Page', 'Type', 'x1', 'y1', 'x2', 'y2']). \
-  sort_values(['Page', 'Type'], key = lambda x: x if x.name == 'Page' else [UnderlineType[y].value for y in x]). \
-  to_csv(path_or_buf = 'Lines.csv', index = False)
+      sys.stdout.flush()
+      proc_pages_parallel(self.executor, self.jobs, workflow_data, rows, self.results, self.transcript, profile)
+
+  def add_file(self, path, workflow_list = None, chunksize = None):
+    for workflow, rows in self.select(path, workflow_list, chunksize).items(): self.add_rows(workflow, rows)
+
+  #Add the rows of the checkpoint that are not yet in results, for each workflow given rows
+  #Each classification's rows are loaded once, however many times rows were added and tables built
+  def load_checkpoint(self, profile = Profile()):
+    with profile.stage('checkpoint load'):
+      for workflow, after in self.loaded.items():
+        self.loaded[workflow] = self.checkpoint.load(self.workflows[workflow], self.results, after)
+
+  #The output tables (and any consensus and merged lines tables), sorted, as a dict from table name to DataFrame
+  def tables(self):
+    import pandas as pd
+    self.load_checkpoint()
+    tables = {}
+    for name, table in OUTPUT_TABLES.items():
+      frames = list(sorted_frames(self.results, table))
+      tables[name] = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index = True)
+    if self.consensus is not None:
+      for name, rows in self.consensus.tables().items():
+        tables[name] = pd.DataFrame(list(rows), columns = list(CONSENSUS_TABLES[name]['columns']))
+    if self.merge_lines:
+      tables['Lines_Merged'] = pd.DataFrame(merged_lines(self.results.lines), columns = list(MERGED_LINES_COLUMNS))
+    return tables
+
+  #Write the output tables (and any consensus and merged lines tables) to files named for them, after prefix
+  #(by default, in the current directory)
+  def write(self, output_format = 'csv', profile = Profile(), prefix = ''):
+    self.load_checkpoint(profile)
+    write_results(self.results, output_format, profile, prefix)
+    if self.consensus is not None: write_consensus(self.consensus, output_format, profile, prefix)
+    if self.merge_lines: write_merged_lines(self.results.lines, output_format, profile, prefix)
+
+def main():
+  parser = argparse.ArgumentParser(
+    description='''Aggregate data from S&B workflows''',
+    epilog="Example: ./aggregate.py",
+    formatter_class=argparse.RawTextHelpFormatter
+  )
+  parser.add_argument('classifications', nargs='*', default=['scarlets-and-blues-classifications.csv'], help='Classifications files, or stores converted from them with --convert.\nA classification in more than one of them is aggregated only once.\n(default: scarlets-and-blues-classifications.csv)')
+  parser.add_argument('-r', '--readers', type=int, default=2, help='Read up to this many classifications files at a time, ahead of\nprocessing (default: 2)')
+  parser.add_argument('-p', '--output-prefix', default='', help='Prefix for the names of the output tables, such as a directory:\nout/ or out/run1- (default: none, so the current directory)')
+  parser.add_argument('--convert', default=None, help='Convert the classifications file into a store in this (new) file, for\nrepeated runs that each read only the selected workflows, and exit')
+  parser.add_argument('-d', '--dump', action='store_true', help='Dump raw JSON')
+  parser.add_argument('-w', '--workflow', nargs='*', default=[], help='Workflows to aggregate, by name, or as Name:Type:id:version[:alpha]\n(default: all of WORKFLOWS)')
+  parser.add_argument('-c', '--chunksize', type=int, default=None, help='Stream the classifications file this many rows at a time,\nkeeping only rows for the selected workflows (default: read whole file)')
+  parser.add_argument('-j', '--jobs', type=int, default=1, help='Process pages in this many worker processes (default: 1, no workers)')
+  parser.add_argument('-o', '--output-format', choices=OUTPUT_FORMATS.keys(), default='csv', help='Format of the output tables (default: csv)\nparquet and feather need pyarrow')
+  parser.add_argument('-q', '--quiet', action='store_true', help='Do not produce the transcript')
+  parser.add_argument('-t', '--transcript', default=None, help='Write the transcript to this file instead of stdout')
+  parser.add_argument('--transcript-format', choices=['text', 'jsonl'], default='text', help='Format of the transcript: plain text, or one JSON object per page (default: text)')
+  parser.add_argument('-s', '--spill', type=int, default=None, help='Hold at most this many rows of each output table in memory, spilling\nsorted runs to temporary files and merging them when writing\n(default: hold all output in memory)')
+  parser.add_argument('--pageref-cache', type=int, default=PAGEREF_CACHE_SIZE, help=f'Number of parsed page reference strings to cache (default: {PAGEREF_CACHE_SIZE})')
+  parser.add_argument('--profile', default=None, help='Write a JSON report of the time spent in, and the counts for, each stage\nof the run, the annotations for each task ID and peak memory to this file')
+  parser.add_argument('--consensus', action='store_true', help='Also write the consensus of the volunteers who classified each page\n(Consensus_Index.csv and so on), matching their rows by subject and page')
+  parser.add_argument('--merge-lines', action='store_true', help='Also write Lines_Merged.csv: the underlining segments of each page and\ntype, from all classifications, merged where they match')
+  parser.add_argument('-k', '--checkpoint', default=None, help='SQLite file of already-aggregated classifications: only classifications\nnot already in it are processed (and added to it), and the outputs\ncover everything in it for the selected workflows')
+  args = parser.parse_args()
+
+  workflow_list = []
+  for x in args.workflow:
+    parts = x.split(':')
+    if len(parts) == 4 or (len(parts) == 5 and parts[4] == 'alpha'):
+      if parts[0] in WORKFLOWS:
+        print(f'Warning: replacing {parts[0]} in WORKFLOWS')
+      workflow_list.append(parts[0])
+      WORKFLOWS[parts[0]] = {
+        'type': WorkflowType[parts[1].upper()],
+        'id': int(parts[2]),
+        'version': float(parts[3]),
+      }
+      if len(parts) == 5: WORKFLOWS[parts[0]]['alpha'] = True
+    elif len(parts) == 1:
+      workflow_list.append(parts[0])
+    else:
+      exit(f'Bad args: workflow argument {parts} must have 1, 4 or 5 parts')
+  if len(workflow_list) == 0: workflow_list = WORKFLOWS.keys()
+
+  if args.chunksize is not None and args.chunksize < 1: exit(f'Bad args: chunksize must be positive, got {args.chunksize}')
+  if args.jobs < 1: exit(f'Bad args: jobs must be positive, got {args.jobs}')
+  if args.consensus and args.checkpoint is not None: exit('Bad args: consensus cannot be used with a checkpoint')
+  if args.readers < 1: exit(f'Bad args: readers must be positive, got {args.readers}')
+  if args.spill is not None and args.spill < 1: exit(f'Bad args: spill must be positive, got {args.spill}')
+  if args.pageref_cache < 0: exit(f'Bad args: pageref cache size must not be negative, got {args.pageref_cache}')
+  set_pageref_cache_size(args.pageref_cache)
+  if args.output_format != 'csv':
+    try:
+      import pyarrow
+    except ImportError:
+      exit(f'Bad args: output format {args.output_format} needs pyarrow')
+  if args.convert is not None:
+    if len(args.classifications) != 1: exit(f'Bad args: convert takes one classifications file, got {len(args.classifications)}')
+    Store.convert(args.classifications[0], args.convert, args.chunksize or 10000).close()
+    return
+
+  transcript = Transcript(args.quiet, args.transcript_format == 'jsonl')
+  with contextlib.ExitStack() as stack:
+    if args.transcript is not None and not args.quiet:
+      stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(args.transcript, 'w'))))
+    #Workers are started by a fork server rather than forked from this process, which has the reader threads
+    #of select_all running by the time that the first worker starts: so they get the pageref cache size here
+    executor = stack.enter_context(concurrent.futures.ProcessPoolExecutor(args.jobs, mp_context = multiprocessing.get_context('forkserver'),
+      initializer = set_pageref_cache_size, initargs = (args.pageref_cache,))) if args.jobs > 1 else None
+    if args.checkpoint is None: checkpoint = None
+    else:
+      checkpoint = Checkpoint(args.checkpoint)
+      stack.callback(checkpoint.close)
+    aggregator = Aggregator(WORKFLOWS, transcript, args.spill, executor, args.jobs, checkpoint, args.consensus, args.merge_lines)
+    input_profile = Profile(args.profile is not None)
+    profiles = {workflow: Profile(args.profile is not None) for workflow in workflow_list}
+    report = {'classifications': args.classifications, 'jobs': args.jobs, 'workflows': {}}
+    for path, selected in aggregator.select_all(args.classifications, workflow_list, args.chunksize, input_profile, args.readers):
+      for workflow in workflow_list:
+        workflow_data = WORKFLOWS[workflow]
+        profile = profiles[workflow]
+        #Heading
+        transcript.heading(f'### {workflow} ({workflow_data["type"].name}) {workflow_data["version"]} ({os.path.basename(path)})')
+
+        if args.dump: dump_pages(decode_pages(selected[workflow], full_subject = True))
+
+        aggregator.add_rows(workflow, selected[workflow], profile)
+        if profile.enabled:
+          rows = report['workflows'].get(workflow, {}).get('rows', 0) + len(selected[workflow])
+          report['workflows'][workflow] = {'id': workflow_data['id'], 'version': workflow_data['version'], 'rows': rows,
+                                           **profile.report(), 'peak_rss_mb': peak_rss_mb()}
+    report['input'] = input_profile.report()['stages']
+
+    output_profile = Profile(args.profile is not None)
+    aggregator.write(args.output_format, output_profile, args.output_prefix) #Before the checkpoint is closed, as it is loaded here
+  if args.profile is not None:
+    report['output'] = output_profile.report()['stages']
+    report['peak_rss_mb'] = peak_rss_mb()
+    if executor is not None: report['peak_worker_rss_mb'] = peak_rss_mb(children = True)
+    with open(args.profile, 'w') as f: json.dump(report, f, indent = 2)
+
+if __name__ == '__main__':
+  main()
+
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+
+#Benchmark for aggregate.py
+#Writes a synthetic Zooniverse classifications export with a given number of classifications for each
+#benchmarked workflow (plus rows from workflows that are not selected, as in a real project export),
+#then aggregates each workflow from it in-process, as aggregate.py -w would, and reports the time spent
+#in each stage (CSV read, JSON decode, per-task processing, output write), throughput and peak RSS.
+
+import argparse
+import csv
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import aggregate
+from aggregate import WorkflowType
+
+#aggregate.py imports numpy and pandas only when it first needs them: they are imported here, before any
+#timing, so that their import time does not land in the read stage of whichever workflow runs first
+import numpy
+import pandas
+
+csv.field_size_limit(sys.maxsize)
+
+#Real exports carry the task's help text with every annotation, which is most of the bytes in the file
+LABEL = '[//]: # ({task})\n' + 'Help text for this task, repeated with every annotation in the export. ' * 4
+
+WORDS = ['Meeting', 'Pension', 'Chelsea', 'Hospital', 'Committee', 'Board', 'claims', 'Minutes', 'Secretary',
+         'Governor', 'Treasury', 'allowance', 'Infirmary', 'Estate', 'resolved', 'approved', 'considered']
+NAMES = ['Smith', 'Jones', 'Brown', 'Taylor', 'Wilson', 'Davies', 'Evans', 'Thomas', 'Roberts', 'Walker']
+
+def text(n = 4): return ' '.join(random.choice(WORDS) for _ in range(random.randint(1, n)))
+
+def task(task_id, value): return {'task': task_id, 'task_label': LABEL.format(task = task_id), 'value': value}
+
+#A dropdown answer, or an empty one (in which case the neighbouring textbox carries the value)
+def dropdown(label = None):
+  if label is None: return [{'select_label': ' '}]
+  return [{'select_label': ' ', 'option': True, 'value': label, 'label': label}]
+
+def pagerefs():
+  refs = [str(random.randint(1, 500)) for _ in range(random.randint(1, 3))]
+  if random.random() < 0.3: refs[0] += f' ({random.choice(WORDS)})'
+  return ', '.join(refs)
+
+def index_page():
+  annotations = [task('T20', 'Other page')]
+  for _ in range(random.randint(1, 4)):
+    annotations.append(task('T12', text()))
+    for _ in range(random.randint(1, 3)):
+      annotations.append(task('T11', [task('T13', text()), task('T14', pagerefs()),
+                                      task('T16', text()), task('T17', pagerefs()),
+                                      task('T18', ''),     task('T19', '')]))
+      annotations.append(task('T15', 'Another page\n(This page is complete)'))
+  annotations.append(task('T27', text() if random.random() < 0.2 else ''))
+  return annotations
+
+def names_page():
+  annotations = [task('T20', 'Name list')]
+  for _ in range(random.randint(5, 20)):
+    annotations.append(task('T0', [task('T1', random.choice(NAMES)), task('T2', random.choice('ABCDEFGHJ')),
+                                   task('T8', dropdown(random.choice([None, 'Mr', 'Capt']))), task('T24', ''),
+                                   task('T9', dropdown()), task('T25', random.choice(['', 'Clerk', 'Nurse'])),
+                                   task('T26', text()), task('T6', pagerefs())]))
+    annotations.append(task('T7', 'Yes, there is another name.'))
+  return annotations
+
+def agenda_item(number):
+  return task('T7', [task('T12', dropdown(str(number))), task('T54', ''), task('T13', ''),
+                     task('T5', text(30)), task('T6', text(10)), task('T10', dropdown(random.choice(WORDS)))])
+
+def minutes_front_page(control):
+  return [task('T11', control),
+          task('T9', [f'{random.choice(NAMES)} {random.choice(NAMES)}' for _ in range(random.randint(3, 8))]),
+          task('T3', ''),
+          task('T14', [f'{i}. {text()}: {text()}' for i in range(1, random.randint(2, 6))]),
+          task('T15', 'No, I am ready for the next page.')]
+
+#Tables transcribed column by column, as in the alpha workflows (AlphaTableParser)
+def alpha_minutes_page():
+  if random.random() < 0.2: return minutes_front_page('Front page, with attendance list')
+  annotations = [task('T11', 'Other page'), task('T8', 'Yes, there is at least one table on the page.')]
+  for table in range(random.randint(1, 2)):
+    if table: annotations.append(task('T37', 'Another table'))
+    annotations.append(task('T25', [task('T23', dropdown(str(random.randint(1, 9)))), task('T24', text()), task('T47', text(1)),
+                                    *[task(f'T{x}', text(2)) for x in range(48, 54)]]))
+    for _ in range(random.randint(1, 3)):
+      annotations.append(task('T37', 'Another column'))
+      annotations.append(task('T36', [task('T26', text(1)), *[task(f'T{x}', text(2)) for x in range(30, 36)]]))
+      annotations.append(task('T37', 'More rows in this column'))
+      annotations.append(task('T46', [task(f'T{x}', text(2)) for x in range(39, 46)]))
+  annotations.append(task('T37', 'Nothing else to transcribe'))
+  for number in range(1, random.randint(2, 4)):
+    annotations.append(agenda_item(number))
+    annotations.append(task('T55', 'Yes, there is another agenda item to transcribe.'))
+  annotations.append(task('T28', ''))
+  return annotations
+
+#Tables transcribed row by row, as in the later minutes workflows (TableParser)
+def minutes_page():
+  if random.random() < 0.2: return minutes_front_page('Front page, with attendance list')
+  annotations = [task('T11', 'Another page of meeting minutes'), task('T8', 'Yes, there is at least one table on the page.')]
+  for table in range(random.randint(1, 2)):
+    annotations.append(task('T25', [task('T23', dropdown(str(random.randint(1, 9)))), task('T54', ''), task('T24', text()),
+                                    *[task(f'T{x}', text(1)) for x in range(47, 53)]]))
+    for _ in range(random.randint(2, 10)):
+      annotations.append(task('T36', [task(f'T{x}', text(2)) for x in range(30, 36)]))
+      annotations.append(task('T37', 'Another row'))
+    annotations[-1] = task('T37', 'Another table')
+  annotations[-1] = task('T37', 'Nothing: all tables on this page have been recorded.')
+  for number in range(1, random.randint(2, 4)):
+    annotations.append(agenda_item(number))
+    annotations.append(task('T55', 'Yes, there is another agenda item to transcribe.'))
+  annotations.append(task('T28', text() if random.random() < 0.1 else ''))
+  return annotations
+
+def underlining_page():
+  if random.random() < 0.1: return [task('T1', 'No, this page is not suitable for underlining.')]
+  lines = []
+  for _ in range(random.randint(10, 40)):
+    x, y = random.uniform(200, 1200), random.uniform(200, 2400)
+    lines.append({'x1': x, 'x2': x + random.uniform(100, 600), 'y1': y, 'y2': y + random.uniform(-20, 20),
+                  'tool': random.randint(0, 2), 'frame': 0, 'details': [], 'tool_label': 'Underline'})
+  return [task('T1', 'Yes, this page is suitable for underlining.'), task('T0', lines)]
+
+#The benchmarked workflows: their WORKFLOWS entry and a generator for the annotations of one of their pages
+#NewTable is the row-by-row minutes format, which has no entry in WORKFLOWS (the test declares it with -w)
+BENCH_WORKFLOWS = {
+  'Alpha-Index': (aggregate.WORKFLOWS['Alpha-Index'], index_page),
+  'Alpha-Names': (aggregate.WORKFLOWS['Alpha-Names'], names_page),
+  'Alpha-Minutes': (aggregate.WORKFLOWS['Alpha-Minutes'], alpha_minutes_page),
+  'NewTable': ({'type': WorkflowType.MINUTES, 'id': 17077, 'version': 32.62}, minutes_page),
+  'Alpha-Underlining': (aggregate.WORKFLOWS['Alpha-Underlining'], underlining_page),
+}
+
+#Workflow id used for rows that belong to none of the benchmarked workflows
+OTHER_WORKFLOW_ID = 14702
+
+def generate(path, rows, workflows, other):
+  fields = ['classification_id', 'user_name', 'workflow_id', 'workflow_name', 'workflow_version', 'created_at',
+            'annotations', 'subject_data', 'subject_ids']
+  classification_id = 100000000
+  with open(path, 'w', newline = '') as f:
+    writer = csv.writer(f)
+    writer.writerow(fields)
+    for i in range(rows):
+      for name in workflows:
+        workflow_data, page_generator = BENCH_WORKFLOWS[name]
+        for workflow_id, version, annotations in [(workflow_data['id'], workflow_data['version'], page_generator())] + \
+                                                 [(OTHER_WORKFLOW_ID, 50.52, index_page()) for _ in range(other)]:
+          classification_id += 1
+          subject_id = 45000000 + random.randint(0, 50000)
+          page = str(random.randint(1, 999))
+          subject_data = {str(subject_id): {'retired': None, 'name': f'WO 250/436 {page}', 'page': page,
+                                            'filename': f'WO_250_436_{page}.jpg'}}
+          writer.writerow([classification_id, f'volunteer{random.randint(1, 500)}', workflow_id, name, version,
+                           '2020-11-26 12:00:00 UTC', json.dumps(annotations), json.dumps(subject_data), subject_id])
+
+#Aggregate one workflow from the export, as aggregate.py -w would, timing each stage
+def run(path, name, chunksize, pageref_cache):
+  aggregate.WORKFLOWS[name] = workflow_data = BENCH_WORKFLOWS[name][0]
+  aggregate.set_pageref_cache_size(pageref_cache) #Fresh cache, so the counts are for this workflow
+  stages = {}
+
+  start = time.perf_counter()
+  selected = aggregate.select_classifications(path, [name], chunksize)[name]
+  stages['read'] = time.perf_counter() - start
+
+  start = time.perf_counter()
+  decoded = list(aggregate.decode_pages(selected))
+  stages['decode'] = time.perf_counter() - start
+
+  start = time.perf_counter()
+  results = aggregate.Results()
+  quiet = aggregate.Transcript(quiet = True)
+  for page, annotations in decoded:
+    aggregate.proc_page(workflow_data, page, annotations, results, quiet)
+  stages['process'] = time.perf_counter() - start
+  del decoded
+
+  cwd = os.getcwd()
+  with tempfile.TemporaryDirectory() as directory:
+    os.chdir(directory)
+    try:
+      start = time.perf_counter()
+      aggregate.write_results(results)
+      stages['write'] = time.perf_counter() - start
+    finally:
+      os.chdir(cwd)
+  cache = aggregate.pageref_annotations.cache_info()
+  return {'selected_rows': len(selected), 'seconds': sum(stages.values()), 'stages': stages, 'peak_rss_mb': aggregate.peak_rss_mb(),
+          'pageref_cache': {'hits': cache.hits, 'misses': cache.misses}}
+
+def main():
+  parser = argparse.ArgumentParser(
+    description='''Benchmark aggregate.py on a synthetic classifications export''',
+    epilog="Example: ./benchmark.py -r 2000 -w Alpha-Minutes NewTable",
+    formatter_class=argparse.RawTextHelpFormatter
+  )
+  parser.add_argument('-r', '--rows', type=int, default=1000, help='Classifications per benchmarked workflow (default: 1000)')
+  parser.add_argument('-w', '--workflow', nargs='*', choices=BENCH_WORKFLOWS.keys(), default=list(BENCH_WORKFLOWS.keys()),
+                      help='Workflows to benchmark (default: all)')
+  parser.add_argument('--other', type=int, default=1, help='Rows of an unselected workflow per benchmarked row (default: 1)')
+  parser.add_argument('-c', '--chunksize', type=int, default=None, help='Passed on to the reader, as for aggregate.py')
+  parser.add_argument('-s', '--seed', type=int, default=0, help='Random seed (default: 0)')
+  parser.add_argument('-e', '--export', default=None, help='Keep the generated export in this file\n(default: a temporary file)')
+  parser.add_argument('-i', '--input', default=None, help='Benchmark this existing export instead of generating one')
+  parser.add_argument('--pageref-cache', type=int, default=aggregate.PAGEREF_CACHE_SIZE,
+                      help=f'Size of the page reference cache, as for aggregate.py (default: {aggregate.PAGEREF_CACHE_SIZE})')
+  parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+  args = parser.parse_args()
+
+  random.seed(args.seed)
+  with tempfile.TemporaryDirectory() as directory:
+    path = args.input
+    if path is None:
+      path = args.export or os.path.join(directory, 'classifications.csv')
+      start = time.perf_counter()
+      generate(path, args.rows, args.workflow, args.other)
+      sys.stderr.write(f'Generated {path} ({os.path.getsize(path) / 2**20:.1f} MB) in {time.perf_counter() - start:.1f}s\n')
+    size = os.path.getsize(path)
+    with open(path, newline = '') as f: rows = sum(1 for _ in csv.reader(f)) - 1
+
+    workflows = {name: run(path, name, args.chunksize, args.pageref_cache) for name in args.workflow}
+
+  report = {
+    'export_rows': rows,
+    'export_mb': size / 2**20,
+    'json_decoder': aggregate.json_loads.__module__,
+    'peak_rss_mb': aggregate.peak_rss_mb(),
+    'workflows': workflows,
+  }
+  if args.json:
+    print(json.dumps(report, indent = 2))
+    return
+  print(f'Export: {rows} rows, {size / 2**20:.1f} MB; JSON decoder: {aggregate.json_loads.__module__}')
+  for name, workflow in workflows.items():
+    seconds = workflow['seconds']
+    print(f'{name}: {workflow["selected_rows"]} rows selected, {seconds:.3f}s, {rows / seconds:.0f} rows/s '
+          f'({workflow["selected_rows"] / seconds:.0f} selected rows/s), peak RSS so far {workflow["peak_rss_mb"]:.0f} MB')
+    for stage, stage_seconds in workflow['stages'].items():
+      print(f'  {stage:8} {stage_seconds:8.3f}s {100 * stage_seconds / seconds:5.1f}%')
+    cache = workflow['pageref_cache']
+    if cache['hits'] or cache['misses']: print(f'  pageref cache: {cache["hits"]} hits, {cache["misses"]} misses')
+  print(f'Peak RSS: {aggregate.peak_rss_mb():.0f} MB')
+
+if __name__ == '__main__':
+  main()